@@ -0,0 +1,185 @@
+import sys
+import socket
+import pickle
+import asyncio
+import logging
+from .server import BaseServer
+from .datagram import open_channel
+from . import protocol
+from . import config
+
+
+class AsyncServer(BaseServer):
+    """Multiplayer server running on a single asyncio event loop.
+
+    Accepting connections, reading and writing each client and the fixed-rate
+    tick are all tasks on one loop, so there is one OS thread however many
+    players join, and no lock around the game state. Clients see the same wire
+    protocol as with the threaded Server.
+    """
+
+    def __init__(self, ip=config.LOCAL_IP, port=config.SERVER_PORT):
+        super().__init__()
+        self.addr = (ip, port)
+        self.loop = None
+        self.stopped = None  # asyncio.Event, set to leave serve()
+        self.client_tasks = set()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    def shutdown(self):
+        # Safe to call from any thread, serve() then closes every connection and returns
+        self.running = False
+        if self.loop is None or self.stopped is None or self.loop.is_closed():
+            return  # Never served, or the match ended and asyncio.run closed the loop already
+        try:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+        except RuntimeError:
+            pass  # The loop closed between the check and the call
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        if not self.running:
+            return
+        listener = await asyncio.start_server(self.handle_connection, *self.addr, backlog=config.WAIT_LIST_SIZE)
+        print("Server is listening for connections...")
+        if config.UDP_TRANSPORT:
+            self.udp = open_channel(bind=listener.sockets[0].getsockname())  # Same port number as TCP
+            self.udp.sock.setblocking(False)
+            self.loop.add_reader(self.udp.sock.fileno(), self.read_datagrams)
+        tick_task = asyncio.create_task(self.tick_loop())
+        try:
+            await self.stopped.wait()
+        finally:
+            if self.udp is not None:
+                self.loop.remove_reader(self.udp.sock.fileno())
+                self.udp.close()
+            listener.close()
+            tick_task.cancel()
+            for task in list(self.client_tasks):
+                task.cancel()
+            await asyncio.gather(tick_task, *self.client_tasks, return_exceptions=True)
+            await listener.wait_closed()
+            print("Server stopped listening for connections.")
+            self.log_snapshot_stats()
+
+    async def tick_loop(self):
+        # Fixed-rate tick, sleeping away whatever is left of each tick
+        tick_seconds = 1 / config.SIMULATION_TICK_RATE
+        next_tick = self.loop.time()
+        while self.running:
+            if self.advance():
+                await asyncio.sleep(2)  # Let the game_over messages go out before closing
+                break
+            next_tick += tick_seconds
+            delay = next_tick - self.loop.time()
+            if delay < 0:
+                next_tick = self.loop.time()  # Running behind, do not try to catch up in a burst
+                delay = 0
+            await asyncio.sleep(delay)
+        self.running = False
+        self.stopped.set()
+
+    async def handle_connection(self, reader, writer):
+        self.client_tasks.add(asyncio.current_task())
+        addr = writer.get_extra_info('peername')
+        print(f"New connection from {addr}")
+        sock = writer.get_extra_info('socket')
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(config.TCP_NODELAY))  # asyncio turns it on by default
+        session = self.register_client(writer, addr)
+        client_id = session.client_id
+        session.reader = asyncio.current_task()
+        session.writer = asyncio.create_task(self.write_loop(session))
+        try:
+            self.send_data(session, client_id)
+            while self.running and not session.snake.lost:
+                message = await self.recv_data(reader, session)
+                reply = self.handle_message(session, message)
+                if reply is not None:
+                    self.send_message(session, reply)
+        except asyncio.IncompleteReadError:
+            print(f"Client {client_id} is disconnecting ...")
+        except (pickle.UnpicklingError, ValueError, ConnectionError) as e:
+            print(f"Error receiving data from client {client_id}: {e}")
+        except asyncio.CancelledError:
+            pass  # Server shutdown, the connection is closed below
+        finally:
+            if session.snake.lost:
+                session.end_reason = 'lost'
+            session.outbound.close()
+            try:
+                # Let queued frames such as game_over go out first
+                await asyncio.wait_for(session.writer, config.OUTBOUND_FLUSH_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                session.writer.cancel()
+            self.remove_client(client_id)
+            self.client_tasks.discard(asyncio.current_task())
+
+    async def write_loop(self, session):
+        # The session's writer: drain() holds it back on a slow peer while the outbound queue absorbs the tick
+        ready = asyncio.Event()
+        outbound = session.outbound
+        outbound.on_flush = ready.set
+        try:
+            while True:
+                data = outbound.take()
+                if not data:
+                    if outbound.closed:
+                        break
+                    await ready.wait()
+                    ready.clear()
+                    continue
+                session.connection.write(data)
+                session.bytes_out += len(data)
+                await session.connection.drain()
+        except ConnectionError as e:
+            if not outbound.closed:
+                print(f"Error sending data to client {session.client_id}: {e}")
+                self.close_connection(session.connection)
+
+    async def recv_data(self, reader, session):
+        message_length = protocol.decode_header(await reader.readexactly(protocol.HEADER_SIZE))
+        data = await reader.readexactly(message_length)
+        session.bytes_in += protocol.HEADER_SIZE + message_length
+        return protocol.decode_message(data, self.accepts_pickle(session), from_client=True)
+
+    def close_connection(self, connection):
+        # Abort rather than close, which would first wait to flush to a peer that may not be reading
+        connection.transport.abort()
+
+    def remove_client(self, client_id):
+        print(f"removing {client_id} client ...")
+        session = self.clients.get(client_id)
+        if session is not None:
+            session.connection.close()
+            self.unregister_client(client_id)
+            logging.info(f"Client {client_id}: {session.stats()}")
+        print(f"Client {client_id} disconnected")
+
+
+def check_shutdown(ip=config.LOCAL_IP, port=config.SERVER_PORT):
+    # The host calls shutdown() once its own game is over, by then a finished match may have closed the loop
+    import threading
+    import time
+    server = AsyncServer(ip, port)
+    thread = threading.Thread(target=server.run)
+    thread.start()
+    time.sleep(0.5)
+    server.running = False  # What a win or the host losing does, tick_loop returns and serve() with it
+    thread.join(5)
+    if thread.is_alive() or not server.loop.is_closed():
+        raise SystemExit("The server did not stop after its match ended")
+    server.shutdown()
+    print("shutdown() after the match ended: ok")
+
+
+if __name__ == "__main__":
+    # Dedicated headless server on one event loop: python -m snake_game.src.async_server [ip]
+    # python -m snake_game.src.async_server check runs check_shutdown() instead
+    if sys.argv[1:] == ['check']:
+        check_shutdown()
+    else:
+        server = AsyncServer(sys.argv[1] if len(sys.argv) > 1 else config.LOCAL_IP)
+        server.run()
@@ -0,0 +1,262 @@
+try:
+    import numpy as np
+except ImportError as e:  # Unlike the vectorized collision pass this module has no fallback
+    raise ImportError("batch_env needs NumPy, install it with 'pip install numpy'") from e
+from .engine import World
+from . import config
+
+DIRECTIONS = np.array([config.UP, config.DOWN, config.LEFT, config.RIGHT], dtype=np.int64)
+
+EMPTY, WALL, SLOW_DOWN, SPEED_UP, MUSHROOM, HOLY_GRAIL, BODY, HEAD, FOOD = range(9)
+TERRAIN_CODES = {"wall": WALL, "slow_down": SLOW_DOWN, "speed_up": SPEED_UP, "mushroom": MUSHROOM, "holy_grail": HOLY_GRAIL}
+
+
+def overlap(ax, ay, a_size, bx, by, b_size):
+    # Broadcasting version of rects_collide(square_rect(a), square_rect(b)), with pygame's truncation
+    a_left, a_top = np.trunc(ax - a_size // 2), np.trunc(ay - a_size // 2)
+    b_left, b_top = np.trunc(bx - b_size // 2), np.trunc(by - b_size // 2)
+    return (a_left < b_left + b_size) & (b_left < a_left + a_size) & (a_top < b_top + b_size) & (b_top < a_top + a_size)
+
+
+class BatchSnakeEnv:
+    """N independent single-player games stepped together, for bots and training.
+
+    State is kept as structure-of-arrays: every snake body lives in one
+    (N, capacity, 2) ring buffer, and per-world scalars are (N,) arrays. A step
+    takes one direction action per world (index into DIRECTIONS, or -1 to keep
+    going) and returns rewards, done flags and grid observations for all worlds;
+    finished worlds are reset on the spot.
+
+    Movement, growth, food, self collision, edges and the static terrain effects
+    follow engine.World. Bonuses, mushroom growth and grail moves are not
+    simulated, so terrain stays as loaded from the level file.
+    """
+
+    def __init__(self, num_envs, level_number=config.DEFAULT_LEVEL, capacity=config.BATCH_BODY_CAPACITY,
+                 max_steps=config.BATCH_MAX_STEPS, death_penalty=0.0, seed=None):
+        world = World()
+        world.load_level(level_number)
+        self.num_envs = num_envs
+        self.capacity = capacity
+        self.max_steps = max_steps
+        self.death_penalty = death_penalty
+        self.rng = np.random.default_rng(seed)
+        self.width, self.height = world.width, world.height - world.panel_height
+        self.points_to_complete = world.points_to_complete
+        self.start_position = np.array(world.start_position, dtype=np.float64)
+        self.start_speed = float(world.start_speed)
+        self.block_size = config.SNAKE_SIZE
+
+        terrains = world.terrains
+        self.terrain_position = np.array([terrain.position for terrain in terrains], dtype=np.float64).reshape(-1, 2)
+        self.terrain_size = np.array([terrain.size for terrain in terrains], dtype=np.int64)
+        self.terrain_type = np.array([TERRAIN_CODES.get(terrain.type, EMPTY) for terrain in terrains], dtype=np.int64)
+        self.walls = self.terrain_type == WALL
+
+        self.cell_size = config.BATCH_GRID_CELL
+        self.grid_shape = (self.height // self.cell_size + 1, self.width // self.cell_size + 1)
+        self.terrain_grid = np.zeros(self.grid_shape, dtype=np.uint8)
+        for (x, y), size, code in zip(self.terrain_position, self.terrain_size, self.terrain_type):
+            first_row, last_row = self.cell_range(y, size, self.grid_shape[0])
+            first_col, last_col = self.cell_range(x, size, self.grid_shape[1])
+            self.terrain_grid[first_row:last_row, first_col:last_col] = code
+
+        n = num_envs
+        self.body = np.zeros((n, capacity, 2), dtype=np.float64)
+        self.arc = np.zeros((n, capacity), dtype=np.float64)  # Distance the head had travelled when each point was pushed
+        self.travelled = np.zeros(n, dtype=np.float64)
+        self.head = np.zeros(n, dtype=np.int64)       # Ring index of the head, the tail is head + length - 1
+        self.length = np.zeros(n, dtype=np.int64)
+        self.direction = np.zeros((n, 2), dtype=np.int64)
+        self.speed = np.zeros(n, dtype=np.float64)
+        self.growth = np.zeros(n, dtype=np.int64)
+        self.points = np.zeros(n, dtype=np.float64)
+        self.steps = np.zeros(n, dtype=np.int64)
+        self.food = np.zeros((n, 2), dtype=np.float64)
+        # Segments overlapping the food and each terrain tile, kept up to date as heads and tails move
+        self.food_hits = np.zeros(n, dtype=np.int64)
+        self.terrain_hits = np.zeros((n, len(terrains)), dtype=np.int64)
+        self.reset()
+
+    def cell_range(self, centre, size, limit):
+        first = int(max((centre - size // 2) // self.cell_size, 0))
+        last = int(min((centre + size // 2) // self.cell_size + 1, limit))
+        return first, last
+
+    def reset(self, mask=None):
+        """Restart the worlds selected by the boolean mask (all by default) and return the observations."""
+        if mask is None:
+            mask = np.ones(self.num_envs, dtype=bool)
+        envs = np.flatnonzero(mask)
+        if len(envs):
+            self.head[envs] = 0
+            self.length[envs] = 1
+            self.body[envs, 0] = self.start_position
+            self.arc[envs, 0] = 0
+            self.travelled[envs] = 0
+            self.direction[envs] = config.LEFT
+            self.speed[envs] = self.start_speed
+            self.growth[envs] = 0
+            self.points[envs] = 0
+            self.steps[envs] = 0
+            self.terrain_hits[envs] = self.overlaps_terrain(self.body[envs, 0])
+            self.spawn_food(envs)
+        return self.observe()
+
+    def overlaps_terrain(self, points):
+        return overlap(points[:, 0:1], points[:, 1:2], self.block_size,
+                       self.terrain_position[:, 0], self.terrain_position[:, 1], self.terrain_size).astype(np.int64)
+
+    def overlaps_food(self, envs, points):
+        return overlap(points[:, 0], points[:, 1], self.block_size,
+                       self.food[envs, 0], self.food[envs, 1], config.FOOD_SIZE).astype(np.int64)
+
+    def slots(self, envs):
+        # Head-first ring indexes of the given worlds' bodies, trimmed to the longest of them, and a mask of live ones.
+        # Working on this window instead of the whole ring keeps short snakes cheap.
+        ages = np.arange(max(int(self.length[envs].max(initial=0)), 1))
+        return (self.head[envs, None] + ages) % self.capacity, ages < self.length[envs, None]
+
+    def segments(self, envs):
+        slots, live = self.slots(envs)
+        return self.body[envs[:, None], slots], live
+
+    def spawn_food(self, envs):
+        # A batch of random candidates per world, keep the first that clears walls and the body.
+        # Worlds where every candidate is blocked scan the whole board, like World's free cell listing
+        tries = config.BATCH_SPAWN_TRIES
+        low = config.SCREEN_EDGE_SIZE
+        xs = self.rng.integers(low, self.width - config.SCREEN_EDGE_SIZE + 1, size=(len(envs), tries))
+        ys = self.rng.integers(low, self.height - config.SCREEN_EDGE_SIZE + 1, size=(len(envs), tries))
+        points, live = self.segments(envs)
+        blocked = self.blocked(xs, ys, points, live)
+        rows = np.arange(len(envs))
+        choice = np.argmax(~blocked, axis=1)
+        food_x, food_y = xs[rows, choice], ys[rows, choice]
+        for row in np.flatnonzero(blocked.all(axis=1)):
+            position = self.free_position(points[row:row + 1], live[row:row + 1])
+            if position is not None:  # A board with no room left keeps the blocked candidate
+                food_x[row], food_y[row] = position
+        self.food[envs, 0] = food_x
+        self.food[envs, 1] = food_y
+        self.food_hits[envs] = (overlap(self.food[envs, 0:1], self.food[envs, 1:2], config.FOOD_SIZE,
+                                        points[..., 0], points[..., 1], self.block_size) & live).sum(axis=1)
+
+    def blocked(self, xs, ys, points, live):
+        # (worlds, candidates) mask of food positions overlapping a wall or a live body point, one candidate column at a time
+        blocked = np.zeros(xs.shape, dtype=bool)
+        if self.walls.any():
+            walls = self.terrain_position[self.walls]
+            blocked |= overlap(xs[..., None], ys[..., None], config.FOOD_SIZE,
+                               walls[:, 0], walls[:, 1], self.terrain_size[self.walls]).any(axis=-1)
+        for column in range(xs.shape[1]):
+            hit = overlap(xs[:, column, None], ys[:, column, None], config.FOOD_SIZE,
+                          points[..., 0], points[..., 1], self.block_size)
+            blocked[:, column] |= (hit & live).any(axis=1)
+        return blocked
+
+    def free_position(self, points, live):
+        # A random free food position on a grid of OCCUPANCY_CELL_SIZE steps over one world's board, None if there is none
+        low = config.SCREEN_EDGE_SIZE
+        grid_x, grid_y = np.meshgrid(np.arange(low, self.width - low + 1, config.OCCUPANCY_CELL_SIZE),
+                                     np.arange(low, self.height - low + 1, config.OCCUPANCY_CELL_SIZE))
+        xs, ys = grid_x.reshape(1, -1), grid_y.reshape(1, -1)
+        free = np.flatnonzero(~self.blocked(xs, ys, points, live)[0])
+        if not len(free):
+            return None
+        pick = free[self.rng.integers(len(free))]
+        return xs[0, pick], ys[0, pick]
+
+    def step(self, actions):
+        """Advance every world by one tick. Returns (observations, rewards, dones)."""
+        actions = np.asarray(actions, dtype=np.int64)
+        envs = np.arange(self.num_envs)
+        self.steps += 1
+
+        # Turns are only allowed at right angles, like Snake.change_direction
+        turning = actions >= 0
+        wanted = DIRECTIONS[np.where(turning, actions, 0)]
+        turning &= (self.direction * wanted).sum(axis=1) == 0
+        self.direction[turning] = wanted[turning]
+
+        previous_points = self.points.copy()
+        old_head = self.body[envs, self.head]
+        new_head = old_head + self.direction * (self.speed / config.HEAD_SPEED_PARAMETER)[:, None]
+        self.travelled += np.hypot(new_head[:, 0] - old_head[:, 0], new_head[:, 1] - old_head[:, 1])
+        if (self.length == self.capacity).any():
+            self.grow_capacity()  # Room for the new head, the tail is only dropped below when not growing
+        self.head = (self.head - 1) % self.capacity
+        self.body[envs, self.head] = new_head
+        self.arc[envs, self.head] = self.travelled
+        self.length += 1
+        self.food_hits += self.overlaps_food(envs, new_head)
+        self.terrain_hits += self.overlaps_terrain(new_head)
+        self.speed += config.PASSIVE_SPEED_INCREMENT
+        growing = self.growth > 0
+        self.growth[growing] -= 1
+        self.drop_tail(~growing)
+
+        # The head against its own body, past the neck: points the head has travelled
+        # SELF_COLLISION_NECK_LENGTH beyond along the body, as SelfCollisionIndex measures it
+        slots, live = self.slots(envs)
+        points = self.body[envs[:, None], slots]
+        live &= self.travelled[:, None] - self.arc[envs[:, None], slots] >= config.SELF_COLLISION_NECK_LENGTH
+        hit = overlap(new_head[:, 0:1], new_head[:, 1:2], self.block_size, points[..., 0], points[..., 1], self.block_size)
+        dead = (hit & live).any(axis=1)
+
+        eaten = self.food_hits > 0
+        self.growth[eaten] += config.SNAKE_GROWTH_RATE
+        self.points[eaten] += 1
+        if eaten.any():
+            self.spawn_food(np.flatnonzero(eaten))
+
+        on_tile = self.terrain_hits > 0
+        for code, factor in ((SLOW_DOWN, config.TERRAIN_SLOW_RATE), (SPEED_UP, config.TERRAIN_SPEEDUP_RATE)):
+            self.speed *= factor ** (on_tile & (self.terrain_type == code)).sum(axis=1)
+        self.points += config.HOLY_GRAIL_ADD * (on_tile & (self.terrain_type == HOLY_GRAIL)).sum(axis=1)
+        dead |= (on_tile & self.walls).any(axis=1)
+
+        dead |= ((new_head[:, 0] < 0) | (new_head[:, 0] >= self.width)
+                 | (new_head[:, 1] < 0) | (new_head[:, 1] >= self.height - 2))
+
+        rewards = self.points - previous_points - self.death_penalty * dead
+        dones = dead | (self.points >= self.points_to_complete) | (self.steps >= self.max_steps)
+        return self.reset(dones), rewards, dones
+
+    def grow_capacity(self):
+        # Double the ring buffer, each body is copied head first from slot 0 on
+        envs = np.arange(self.num_envs)
+        order = (self.head[:, None] + np.arange(self.capacity)) % self.capacity
+        for name in ('body', 'arc'):
+            old = getattr(self, name)
+            new = np.zeros((self.num_envs, 2 * self.capacity) + old.shape[2:], dtype=old.dtype)
+            new[:, :self.capacity] = old[envs[:, None], order]
+            setattr(self, name, new)
+        self.head[:] = 0
+        self.capacity *= 2
+
+    def drop_tail(self, mask):
+        envs = np.flatnonzero(mask & (self.length > 0))
+        if not len(envs):
+            return
+        tail = self.body[envs, (self.head[envs] + self.length[envs] - 1) % self.capacity]
+        self.food_hits[envs] -= self.overlaps_food(envs, tail)
+        self.terrain_hits[envs] -= self.overlaps_terrain(tail)
+        self.length[envs] -= 1
+
+    def observe(self):
+        """(N, rows, cols) uint8 grids: terrain codes, then BODY, HEAD and FOOD cells on top."""
+        grid = np.broadcast_to(self.terrain_grid, (self.num_envs,) + self.grid_shape).copy()
+        envs = np.arange(self.num_envs)
+
+        points, live = self.segments(envs)
+        self.mark(grid, np.nonzero(live)[0], points[live], BODY)
+        self.mark(grid, envs, self.body[envs, self.head], HEAD)
+        self.mark(grid, envs, self.food, FOOD)
+        return grid
+
+    def mark(self, grid, envs, points, code):
+        rows = (points[:, 1] // self.cell_size).astype(np.int64)
+        cols = (points[:, 0] // self.cell_size).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.grid_shape[0]) & (cols >= 0) & (cols < self.grid_shape[1])
+        grid[envs[inside], rows[inside], cols[inside]] = code
@@ -1,5 +1,3 @@
-import pygame
-from .drawing import draw_bonus
 from . import config
 
 class Bonus:
@@ -9,6 +7,7 @@ class Bonus:
         self.size = config.BONUS_SIZES.get(self.type, config.DEFAULT_BONUS_SIZE)
 
     def draw(self, screen):
+        from .drawing import draw_bonus
         draw_bonus(screen, self.position, self.size, self.type)
 
     def get_bonus_data(self):
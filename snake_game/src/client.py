@@ -1,7 +1,14 @@
 import pygame
 import socket
+from collections import OrderedDict
 from . import config
+from . import protocol
 from .network import Network
+from .snapshot_delta import apply_delta
+from .prediction import ClientView
+from .lockstep import Lockstep
+from .level_cache import level_hash, load_cached_level, store_level
+import json
 import pickle
 import threading
 
@@ -9,23 +16,136 @@ class Client:
     def __init__(self, ip, snake_color):
         self.network = Network(ip)
         self.player_id = self.network.get_player_id()
+        if config.BINARY_PROTOCOL:
+            self.network.negotiate()
+        self.level = None  # Parsed level definition, binary keyframes leave its static parts out
+        self.level_bytes = None
+        self.static_terrains = []
+        if self.network.level_hash is not None:
+            self.fetch_level(self.network.level_hash)
+        self.wants_lockstep = config.LOCKSTEP and self.network.version >= protocol.LOCKSTEP_MIN_VERSION and self.level is not None
+        self.lockstep = None  # Our own copy of the match once the server starts relaying ticks
+        self.udp = not self.wants_lockstep and config.UDP_TRANSPORT and self.network.version != protocol.PICKLE_VERSION and self.network.open_udp()
         self.game_state = None
+        self.snapshots = OrderedDict()  # seq -> applied game state, what the server may send deltas against
+        self.latest_seq = 0
+        self.view = ClientView(self.player_id) if config.CLIENT_PREDICTION else None
         self.recv_lock = threading.Lock()
 
+    def fetch_level(self, wanted_hash):
+        # From the local cache when possible, otherwise once from the server
+        level_bytes = load_cached_level(wanted_hash)
+        if level_bytes is None:
+            reply = self.network.get_level()
+            if not (isinstance(reply, tuple) and reply[0] == 'level' and level_hash(reply[2]) == wanted_hash):
+                print("Server sent no valid level data")
+                self.network.connected = False
+                return
+            level_bytes = reply[2]
+            store_level(level_bytes)
+        self.level_bytes = level_bytes
+        self.level = json.loads(level_bytes)
+        self.static_terrains = [{'type': terrain['type'], 'position': terrain['position']} for terrain in self.level['terrains']
+                                if terrain['type'] not in config.DYNAMIC_TERRAIN_TYPES]
+
     def update_direction(self, new_direction):
-        self.network.send_data(('update_direction', self.player_id, new_direction))
+        if self.udp:
+            self.network.send_inputs(self.player_id, new_direction)
+        else:
+            self.network.input_seq += 1
+            self.network.send_data(('update_direction', self.player_id, new_direction, self.network.input_seq))
+        if self.view is not None:
+            self.view.add_input(self.network.input_seq, new_direction)
 
     def disconnect(self):
         self.network.send_data(('disconnecting', self.player_id))
         print('Connection lost')
         self.network.connected = False
 
+    def subscribe(self):
+        # Ask the server to push a snapshot every tick from now on; a UDP client's first datagram does that
+        if self.wants_lockstep:
+            self.network.send_data(('request_lockstep',))
+            return
+        if self.udp:
+            self.network.send_inputs(self.player_id)
+            return
+        self.network.send_data(('subscribe', self.player_id))
+
+    def receive_game_state(self):
+        if not self.udp:
+            message = self.network.recv_data()
+            if isinstance(message, tuple) and message[0] in ('lockstep', 'tick'):
+                self.accept_tick(message)
+            else:
+                self.accept_game_state(message)
+            return
+        message = self.network.recv_any(config.UDP_RESEND_INTERVAL)
+        if message is None:
+            self.network.send_inputs(self.player_id)  # Nothing came: the registration or the last inputs may be lost
+        else:
+            self.accept_game_state(message)
+
     def request_game_state(self):
         try:
-            self.game_state = self.network.get_game_state()
+            self.accept_game_state(self.network.get_game_state())
         except (socket.error, EOFError):
             self.game_state = {'end_reason': 'server_closed'}
 
+    def accept_tick(self, message):
+        # Lockstep: run the match ourselves from a checkpoint and the relayed events, reporting the world hash now and then
+        try:
+            if message[0] == 'lockstep':
+                _, tick, checkpoint, log = message
+                self.view = None  # Every snake comes from our own world, there is nothing to predict or interpolate
+                self.lockstep = Lockstep(checkpoint, self.level_bytes)
+                self.lockstep.replay(tick, log)
+            elif self.lockstep is not None:
+                self.lockstep.advance(message[1], message[2])
+            else:
+                return
+        except ValueError as e:
+            print(f"Lockstep stopped: {e}")
+            self.network.connected = False
+            self.game_state = {'action': 'game_over', 'reason': 'desync'}
+            return
+        if self.lockstep.hash_due():
+            self.network.send_data(('state_hash', self.lockstep.world.ticks, self.lockstep.world.state_hash()))
+        self.game_state = self.lockstep.game_state()
+
+    def accept_game_state(self, game_state):
+        # Rebuild deltas from the snapshot they were made against, and acknowledge every snapshot applied
+        if game_state.get('seq', self.latest_seq + 1) <= self.latest_seq:
+            return  # A datagram overtaken by a newer snapshot
+        if 'base_seq' in game_state:
+            base = self.snapshots.get(game_state['base_seq'])
+            try:
+                if base is None:
+                    raise ValueError(f"No snapshot {game_state['base_seq']} to apply the delta to")
+                game_state = apply_delta(base, game_state)
+            except ValueError as e:
+                print(f"Dropping delta: {e}")
+                self.network.acked = 0
+                self.network.send_data(('request_keyframe', self.player_id))
+                return
+        elif 'seq' in game_state and self.network.version != protocol.PICKLE_VERSION and self.level is not None:
+            # Keyframe without the level's static parts, add them back once so deltas patch a complete state
+            game_state['terrains'] = self.static_terrains + game_state['terrains']
+            game_state['points_to_complete'] = self.level['points_to_complete']
+        if 'seq' in game_state and self.network.version != protocol.PICKLE_VERSION:
+            self.latest_seq = game_state['seq']
+            self.snapshots[game_state['seq']] = game_state
+            while len(self.snapshots) > config.DELTA_HISTORY:
+                self.snapshots.popitem(last=False)
+            if self.udp:
+                self.network.acked = game_state['seq']
+                self.network.send_inputs(self.player_id)
+            else:
+                self.network.send_data(('ack', game_state['seq']))
+        if self.view is not None and 'snakes' in game_state and 'elapsed' in game_state:
+            self.view.add_snapshot(game_state)
+        self.game_state = game_state
+
     def handle_input(self):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -35,6 +155,8 @@ class Client:
                 if not (self.player_id in self.game_state['snakes']):
                     return False
                 snake_direction = self.game_state['snakes'][self.player_id]['direction']
+                if self.view is not None:
+                    snake_direction = self.view.direction() or snake_direction  # Turns not in a snapshot yet count too
                 if event.key == pygame.K_UP and snake_direction != config.UP:
                     self.update_direction(config.DOWN)
                 elif event.key == pygame.K_DOWN and snake_direction != config.DOWN:
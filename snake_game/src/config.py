@@ -70,18 +70,23 @@ SNAKE_INCREMENT = 200 # Determines when the tail starts to calculate collision
 TERRAIN_SLOW_RATE = 0.999
 TERRAIN_SPEEDUP_RATE = 1.0003
 HOLY_GRAIL_ADD = 0.1
-UPDATE_DELAY = 5
 BONUS_POINTS = 5
 CLOCK_TICK = 120
+SIMULATION_TICK_RATE = 120 # Fixed simulation steps per second, independent of the frame rate
+MAX_RENDER_FPS = 240 # Frame cap so fast machines do not spin drawing identical frames
+MAX_FRAME_TIME = 250 # milliseconds, longest stall the simulation catches up on after a hitch
 
 #SNAKE
 START_POS = (400, 300)
 SNAKE_SIZE = 14
 START_SPEED = 4
 HEAD_SPEED_PARAMETER = 4
+SELF_COLLISION_NECK_LENGTH = SNAKE_INCREMENT / HEAD_SPEED_PARAMETER # Body length behind the head that it cannot hit, in pixels
 PASSIVE_SPEED_INCREMENT = 0.00005
 DEFAULT_SPEED_FACTOR = 1.2
 DEFAULT_SLOW_FACTOR = 0.5
+SNAKE_BODY_CAPACITY = 1024 # Initial ring buffer size in points, doubles when full
+SPATIAL_HASH_CELL_SIZE = SNAKE_SIZE
 #DRAWING
 PANEL_BORDER_THICKNESS = 2
 PANEL_FONT = 18
@@ -118,8 +123,17 @@ TERRAIN_COLORS = {
 }
 DEFAULT_TERRAIN_SIZE = 20
 GRAIL_CHANGE_TIME = 60000
+TERRAIN_INDEX_CELL_SIZE = 50 # Bucket size of the wall lookup grid, about one wall tile
+OCCUPANCY_CELL_SIZE = 10 # Cell size of the spawn occupancy bitmap
+SPAWN_RANDOM_TRIES = 20 # Random cells tried before listing every free cell
 MUSHROOM_GROW_TIME = 50000
 
+#BATCH_ENV
+BATCH_BODY_CAPACITY = 4096 # Ring buffer slots per world to start with, doubled when a snake outgrows them
+BATCH_MAX_STEPS = 20000 # Worlds are reset after this many ticks
+BATCH_GRID_CELL = SNAKE_SIZE # Cell size of the observation grids
+BATCH_SPAWN_TRIES = 16 # Random food candidates drawn per world at once
+
 #LEVEL_SELECTION
 LEVELS_LINES_GAP = 40
 LEVELS_TEXT_HEIGHT = 60
@@ -146,6 +160,39 @@ MULTIPLAYER_OPTIONS = [
     ("3", "Back"),
 ]
 DEFAULT_LEVEL = 1
+SERVER_PORT = 5432
+ASYNC_SERVER = True # Host games on one asyncio event loop instead of a thread per client
+PUSH_GAME_STATE = True # Clients subscribe to a snapshot per tick instead of polling with requests
+BINARY_PROTOCOL = True # Clients offer the struct-packed protocol at connect, servers fall back to pickle for old clients
+ACCEPT_PICKLE_CLIENTS = True # Serve clients that never negotiate; their pickled messages can run code on the server
 WAIT_LIST_SIZE = 5
 BYTES_RECV = 4096
+DELTA_SNAPSHOTS = True # Send binary clients only what changed since the snapshot they acknowledged
+DELTA_HISTORY = 64 # Snapshots remembered on both sides as possible delta bases
+KEYFRAME_INTERVAL = 0 # Snapshots between full keyframes for a client receiving deltas, 0 sends them only on join and resync
+DYNAMIC_TERRAIN_TYPES = ("mushroom", "holy_grail") # The only terrain that changes after loading, the rest comes with the level
+LEVEL_CACHE_DIR = "snake_game/levels/cache" # Level definitions received from servers, by content hash
+OUTBOUND_QUEUE_SIZE = 32 # Encoded frames waiting for one client's writer before state frames are dropped
+SLOW_CLIENT_DROPS = 120 # State frames a client may miss before its writer catches up, then it is disconnected
+OUTBOUND_FLUSH_TIMEOUT = 1.0 # Seconds a leaving client's writer gets to send what is still queued
+TCP_NODELAY = True # Send small frames such as direction changes at once instead of holding them back for Nagle's algorithm
+INPUT_QUEUE_SIZE = 8 # Direction inputs a client can have waiting for ticks, older ones are dropped beyond that
+UDP_TRANSPORT = False # Snapshots and inputs over UDP when both ends support it, TCP stays for joining and game over
+UDP_INPUT_REDUNDANCY = 4 # Latest direction inputs repeated in every client datagram, so a lost one costs no input
+UDP_RESEND_INTERVAL = 0.05 # Seconds without a snapshot before a UDP client sends its inputs again, which also registers it
+UDP_PACKET_LOSS = 0.0 # Share of datagrams dropped on purpose on both ends, to test loss on loopback
+MAX_DATAGRAM_SIZE = 65507 # Snapshots that do not fit in one datagram go over TCP
+CLIENT_PREDICTION = True # Draw our own snake predicted from local inputs and the others interpolated between snapshots
+INTERPOLATION_DELAY_TICKS = 3 # Remote snakes are drawn this far in the past, so there is a newer snapshot to move towards
+INTERPOLATION_BUFFER = 16 # Snapshots kept for interpolation
+MAX_PREDICTION_TICKS = 60 # Longest replay of our own snake past the newest snapshot
+PREDICTION_INPUT_TIMEOUT = 1.0 # Seconds before an input no snapshot confirmed stops being predicted
+LOCKSTEP = False # Servers relay each tick's inputs and clients run the match themselves, no snapshots are sent
+LOCKSTEP_HASH_INTERVAL = 60 # Ticks between the world hashes lockstep clients report, a mismatch is logged as a desync
+LOCKSTEP_HASH_HISTORY = 32 # Server world hashes kept to compare late reports against
+LOCKSTEP_CHECKPOINT_INTERVAL = 600 # Ticks between the world checkpoints late lockstep joiners start from, older events are dropped
+COMPACT_SNAKE_DATA = False # Send snakes as turn points and length instead of every body point
+VECTORIZED_COLLISIONS = False # Resolve server collisions in one NumPy pass per tick (needs numpy)
+POLYLINE_COLLISIONS = False # Test server collisions against each snake's turn-point segments instead of every body point
+VECTORIZED_COLLISION_CHUNK = 16 # Objects tested per array operation, bounds temporary memory
 MAGIC_NUMBER = b'SKNG'  # 4-byte magic number for message validation
\ No newline at end of file
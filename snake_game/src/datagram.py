@@ -0,0 +1,59 @@
+import random
+import socket
+from . import protocol
+from . import config
+
+
+class DatagramChannel:
+    """UDP socket carrying one framed message per datagram.
+
+    Snapshots and inputs may be lost or reordered, which is what lets a late
+    packet be skipped instead of stalling everything behind it. Sends go
+    through drop(), a hook that loses packets on purpose: it drops a
+    config.UDP_PACKET_LOSS share of them and can be replaced to test other
+    loss patterns on loopback.
+    """
+
+    def __init__(self, sock, loss=config.UDP_PACKET_LOSS):
+        self.sock = sock
+        self.loss = loss
+        self.drop = lambda: self.loss > 0 and random.random() < self.loss
+        self.sent = 0
+        self.dropped = 0
+
+    def send(self, message, addr=None):
+        # Best effort: a datagram the socket cannot take right away is as lost as one dropped on the way
+        if self.drop():
+            self.dropped += 1
+            return
+        try:
+            if addr is None:
+                self.sock.send(message)
+            else:
+                self.sock.sendto(message, addr)
+            self.sent += 1
+        except OSError:
+            self.dropped += 1
+
+    def recv(self, from_client=False):
+        """The next datagram's message, sender and size, None for one that is not a valid frame. Raises OSError when none is waiting."""
+        datagram, addr = self.sock.recvfrom(config.MAX_DATAGRAM_SIZE)
+        try:
+            if protocol.decode_header(datagram) != len(datagram) - protocol.HEADER_SIZE:
+                raise ValueError("Datagram length does not match its header.")
+            return protocol.decode_message(memoryview(datagram)[protocol.HEADER_SIZE:], allow_pickle=False, from_client=from_client), addr, len(datagram)
+        except ValueError as e:
+            print(f"Dropping datagram from {addr}: {e}")
+            return None, addr, len(datagram)
+
+    def close(self):
+        self.sock.close()
+
+
+def open_channel(addr=None, bind=None):
+    # A UDP channel bound to bind (an ephemeral port if None) and, for clients, connected to addr
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(bind or ('', 0))
+    if addr is not None:
+        sock.connect(addr)
+    return DatagramChannel(sock)
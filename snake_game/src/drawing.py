@@ -29,16 +29,24 @@ def draw_snake(screen, snake_body, block_size, color):
         else:  # Body
             pygame.draw.rect(screen, color, segment_rect)
 
+def draw_snake_path(screen, vertices, block_size, color):
+    # Thick lines between turn points, with a square on every vertex so the corners are filled
+    for start, end in zip(vertices, vertices[1:]):
+        pygame.draw.line(screen, color, start, end, block_size)
+    for vertex in vertices:
+        vertex_rect = pygame.Rect(vertex[0] - block_size // 2, vertex[1] - block_size // 2, block_size, block_size)
+        pygame.draw.rect(screen, color, vertex_rect)
+
 def draw_terrain(screen, position, size, terrain_type):
     color = config.TERRAIN_COLORS.get(terrain_type, config.BLACK)
     terrain_rect = pygame.Rect(position[0] - size // 2, position[1] - size // 2, size, size)
     pygame.draw.rect(screen, color, terrain_rect)
 
-def draw_game(screen, terrains, snake, foods, bonuses, panel_height, points, points_to_complete, start_time):
+def draw_game(screen, terrains, snake, foods, bonuses, panel_height, points, points_to_complete, start_time, alpha=1.0):
     screen.fill(config.BLACK)  # Clear screen
     for terrain in terrains:
         terrain.draw(screen)
-    snake.draw(screen)
+    snake.draw(screen, alpha)
     for food in foods:
         food.draw(screen)
     for bonus in bonuses:
@@ -58,7 +66,7 @@ def draw_game(screen, terrains, snake, foods, bonuses, panel_height, points, poi
     text_color = config.WHITE
     # Display the current points, length, speed, and time passed
     points_text = font.render(f"Points: {int(points)}/{points_to_complete}", True, text_color)
-    length_text = font.render(f"Length: {len(snake.body) // config.SNAKE_GROWTH_RATE}", True, text_color)
+    length_text = font.render(f"Length: {snake.body_length() // config.SNAKE_GROWTH_RATE}", True, text_color)
     speed_text = font.render(f"Speed: {snake.speed:.2f}", True, text_color)
     time_passed = (pygame.time.get_ticks() - start_time) // 1000
     time_text = font.render(f"Time: {time_passed}s", True, text_color)
@@ -98,7 +106,7 @@ def draw_game_multiplayer(screen, terrains, snakes, foods, bonuses, points_to_co
         snake = snakes[self_id]
         points = snake.points
         points_text = font.render(f"Points: {int(points)}/{points_to_complete}", True, text_color)
-        length_text = font.render(f"Length: {len(snake.body) // config.SNAKE_GROWTH_RATE}", True, text_color)
+        length_text = font.render(f"Length: {snake.body_length() // config.SNAKE_GROWTH_RATE}", True, text_color)
         speed_text = font.render(f"Speed: {snake.speed:.2f}", True, text_color)
 
         screen.blit(points_text, (config.POINTS_POS, panel_y + panel_height // 2 - points_text.get_height() // 2))
@@ -0,0 +1,432 @@
+import json
+import zlib
+import random
+import logging
+from array import array
+from itertools import chain
+from .snake import Snake
+from .bonus import Bonus
+from .terrain import Terrain
+from .food import Food
+from .spatial_hash import SpatialHash
+from .occupancy import OccupancyGrid
+from .terrain_index import TerrainIndex
+from .self_collision import SelfCollisionIndex
+from .level_cache import level_hash
+from . import vector_collision
+from . import config
+
+
+class World:
+    """Game rules and state without pygame or a display.
+
+    The world is advanced by explicit calls to step(), one simulation tick each,
+    and its clock is the tick count. Game drives it with a single snake and
+    Server with one snake per client, so the rules live in one place and can
+    run headless (dedicated servers, fast-forward, benchmarks). Every random
+    choice comes from the world's own generator, so two worlds created with
+    the same seed and given the same events stay identical.
+    """
+
+    def __init__(self, width=config.SCREEN_WIDTH, height=config.SCREEN_HEIGHT, panel_height=config.PANEL_HEIGHT,
+                 self_collision=False, edge_collision=False, single_bonus=False, vectorized_collisions=False,
+                 polyline_collisions=False, seed=None):
+        self.width, self.height = width, height
+        self.panel_height = panel_height
+        self.self_collision = self_collision  # Single player: the head may not touch its own tail
+        self.edge_collision = edge_collision  # Single player: leaving the board loses
+        self.single_bonus = single_bonus  # Single player: at most one bonus is collected per tick
+        self.vectorized_collisions = vectorized_collisions and vector_collision.available()
+        if vectorized_collisions and not self.vectorized_collisions:
+            logging.warning("NumPy is not installed, using per-object collision checks")
+        self.polyline_collisions = polyline_collisions  # Test against each snake's straight runs instead of its points
+
+        self.snakes = {}  # owner -> Snake, in join order; the first colliding owner wins food and bonuses
+        self.terrains = []
+        self.terrain_index = TerrainIndex(self.terrains)
+        self.foods = []
+        self.bonuses = []
+        self.points_to_complete = 0
+        self.possible_bonus_types = []
+        self.start_position = config.START_POS
+        self.start_speed = config.START_SPEED
+        self.level_bytes = b''  # JSON definition of the loaded level, sent once to clients that lack it
+        self.level_hash = None
+        self.snake_index = SpatialHash()  # Segments of every snake, for collision queries
+        self.self_index = SelfCollisionIndex()  # Body cells past each snake's neck, for its own head
+        self.occupancy = OccupancyGrid(self.width, self.height - self.panel_height)  # Free cells for spawning
+
+        self.seed = seed
+        self.rng = random.Random(seed)  # Spawns, mushrooms, the grail and tripping snakes all draw from this
+        self.ticks = 0
+        self.bonus_spawn_timer = 0
+        self.grail_spawn_timer = 0
+        self.shroom_spawn_timer = 0
+        self.bonus_spawn_interval = config.BONUS_SPAWN_INTERVAL  # Time in milliseconds between bonus spawns
+
+    @property
+    def elapsed(self):
+        # Game time in milliseconds, derived from the tick count
+        return self.ticks * 1000 / config.SIMULATION_TICK_RATE
+
+    def load_level(self, level_number):
+        level_file = f"snake_game/levels/level_{level_number}.json"
+        with open(level_file, "rb") as file:
+            self.load_level_data(file.read())
+
+    def load_level_data(self, level_bytes):
+        # A level definition as stored in the level files, clients may have it from the server's cache only
+        self.level_bytes = level_bytes
+        self.level_hash = level_hash(self.level_bytes)
+        level_data = json.loads(self.level_bytes)
+
+        snake_data = level_data["snake"]
+        self.start_position = tuple(snake_data["initial_position"])
+        self.start_speed = snake_data["initial_speed"]
+
+        # Load points to complete and possible bonus types
+        self.points_to_complete = level_data["points_to_complete"]
+        self.possible_bonus_types = level_data["possible_bonus_types"]
+
+        # Load terrains
+        self.terrains = []
+        for terrain_data in level_data["terrains"]:
+            terrain = Terrain(terrain_data["position"], terrain_data["type"])
+            self.terrains.append(terrain)
+        self.terrain_index = TerrainIndex(self.terrains)
+        self.occupancy.set_walls(self.terrain_index.of_type("wall"))
+
+        self.foods = []
+        self.bonuses = []
+
+    def add_snake(self, owner, snake):
+        if self.polyline_collisions and snake.path is None:
+            snake.enable_path()
+        snake.attach(self.snake_index, owner)
+        snake.attach(self.occupancy, owner)
+        if self.self_collision:
+            snake.attach(self.self_index, owner)
+        self.snakes[owner] = snake
+
+    def remove_snake(self, owner):
+        snake = self.snakes.pop(owner, None)
+        if snake is not None:
+            snake.detach(self.snake_index)
+            snake.detach(self.occupancy)
+            snake.detach(self.self_index)
+
+    def apply_event(self, event):
+        # A change made between ticks: ('join', owner, x, y), ('direction', owner, dx, dy), ('lost', owner, 0, 0) or ('leave', owner, 0, 0)
+        kind, owner, x, y = event
+        if kind == 'join':
+            self.add_snake(owner, Snake(start_pos=(x, y)))
+        elif owner not in self.snakes:
+            return
+        elif kind == 'direction':
+            self.snakes[owner].direction = (x, y)
+        elif kind == 'lost':
+            self.snakes[owner].lost = True
+        elif kind == 'leave':
+            self.remove_snake(owner)
+
+    def state_hash(self):
+        """CRC32 of everything the rules read, equal on two worlds only while they agree."""
+        # Pairs are hashed as tuples, level files and restore() give lists where the rules make tuples
+        crc = zlib.crc32(repr((self.ticks, self.bonus_spawn_timer, self.grail_spawn_timer, self.shroom_spawn_timer,
+                               self.rng.getstate())).encode())
+        for owner, snake in self.snakes.items():
+            crc = zlib.crc32(repr((owner, tuple(snake.direction), snake.speed, snake.points, snake.lost, snake.growth,
+                                   tuple(snake.color))).encode(), crc)
+            crc = zlib.crc32(array('d', chain.from_iterable(snake.body)).tobytes(), crc)
+        crc = zlib.crc32(repr(([tuple(food.position) for food in self.foods],
+                               [(bonus.type, tuple(bonus.position)) for bonus in self.bonuses],
+                               [(terrain.type, tuple(terrain.position)) for terrain in self.terrains])).encode(), crc)
+        return crc
+
+    def checkpoint(self):
+        """Everything state_hash() covers, compressed; restore() on a world with the same level loaded rebuilds it."""
+        state = {
+            'seed': self.seed,
+            'rng': self.rng.getstate(),
+            'ticks': self.ticks,
+            'timers': [self.bonus_spawn_timer, self.grail_spawn_timer, self.shroom_spawn_timer],
+            'snakes': [[owner, snake.body.tolist(), snake.direction, snake.speed, snake.points, snake.lost, snake.growth,
+                        snake.color, snake.input_seq] for owner, snake in self.snakes.items()],
+            'foods': [food.position for food in self.foods],
+            'bonuses': [[bonus.type, bonus.position] for bonus in self.bonuses],
+            'terrains': [[terrain.type, terrain.position] for terrain in self.terrains],
+        }
+        # JSON writes floats exactly, so bodies and speeds come back bit for bit
+        return zlib.compress(json.dumps(state).encode())
+
+    def restore(self, checkpoint):
+        """Replace the state with a checkpoint(). Raises ValueError for one that cannot be read."""
+        try:
+            state = json.loads(zlib.decompress(checkpoint))
+            version, internal, gauss = state['rng']
+            self.rng.setstate((version, tuple(internal), gauss))
+        except (zlib.error, ValueError, TypeError, KeyError) as e:
+            raise ValueError(f"Unreadable world checkpoint: {e}") from e
+        self.seed = state['seed']
+        self.ticks = state['ticks']
+        self.bonus_spawn_timer, self.grail_spawn_timer, self.shroom_spawn_timer = state['timers']
+
+        for owner in list(self.snakes):
+            self.remove_snake(owner)
+        for owner, body, direction, speed, points, lost, growth, color, input_seq in state['snakes']:
+            snake = Snake(color=tuple(color), start_speed=speed)
+            snake.body = [tuple(point) for point in body]
+            snake.direction = tuple(direction)
+            snake.points = points
+            snake.lost = lost
+            snake.growth = growth
+            snake.input_seq = input_seq
+            self.add_snake(owner, snake)  # In join order, the first colliding owner wins food and bonuses
+
+        self.foods = [Food(tuple(position)) for position in state['foods']]
+        self.bonuses = [Bonus(tuple(position), bonus_type) for bonus_type, position in state['bonuses']]
+        self.terrains = [Terrain(tuple(position), terrain_type) for terrain_type, position in state['terrains']]
+        self.terrain_index = TerrainIndex(self.terrains)  # Grown mushrooms and the moved grail are in the list already
+        self.occupancy.set_walls(self.terrain_index.of_type("wall"))
+
+    def find_spawn_position(self, size):
+        # Sample among free cells of the occupancy bitmap, None when the board has no room left
+        return self.occupancy.find_free_position(
+            size,
+            config.SCREEN_EDGE_SIZE, config.SCREEN_EDGE_SIZE,
+            self.width - config.SCREEN_EDGE_SIZE, self.height - config.SCREEN_EDGE_SIZE - self.panel_height,
+            is_free=lambda position: not (self.check_collision(position, size) or self.check_collision_with_terrain(position, size)),
+            rng=self.rng)
+
+    def spawn_food(self):
+        food_position = self.find_spawn_position(Food.size)
+        if food_position is None:
+            logging.warning("No free position left to spawn food")
+            return
+
+        food = Food(food_position)
+        self.foods.append(food)
+
+    def spawn_bonus(self):
+        bonus_type = self.rng.choice(self.possible_bonus_types)
+        bonus_position = self.find_spawn_position(config.BONUS_SIZES[bonus_type])
+        if bonus_position is None:
+            logging.warning("No free position left to spawn a bonus")
+            return
+
+        bonus = Bonus(bonus_position, bonus_type)
+        self.bonuses.append(bonus)
+
+    def grow_mushroom(self):
+        # Find all mushroom terrain
+        mushroom_size = config.TERRAIN_SIZES["mushroom"]
+        mushroom_terrains = self.terrain_index.of_type("mushroom")
+
+        # If no mushroom terrain, do nothing
+        if not mushroom_terrains:
+            return
+
+        # Choose a random mushroom terrain
+        mushroom = self.rng.choice(mushroom_terrains)
+
+        # Calculate adjacent positions
+        adjacent_positions = [
+            (mushroom.position[0] + mushroom_size, mushroom.position[1]),
+            (mushroom.position[0] - mushroom_size, mushroom.position[1]),
+            (mushroom.position[0], mushroom.position[1] + mushroom_size),
+            (mushroom.position[0], mushroom.position[1] - mushroom_size),
+        ]
+
+        # Filter out positions outside the screen
+        adjacent_positions = [
+            pos for pos in adjacent_positions
+            if (0 <= pos[0] <= self.width) and (0 <= pos[1] <= self.height - self.panel_height)
+            and not self.is_position_occupied_by_mushroom(pos)
+        ]
+
+        # Choose a random adjacent position
+        if not adjacent_positions:
+            return
+        new_mushroom_position = self.rng.choice(adjacent_positions)
+
+        # Check if the new position collides with existing terrain
+        if not self.check_collision_with_terrain(new_mushroom_position, mushroom_size):
+            # Create a new mushroom terrain at the chosen position
+            new_mushroom = Terrain(new_mushroom_position, "mushroom")
+            self.terrains.append(new_mushroom)
+            self.terrain_index.add(new_mushroom)
+
+    def move_grail(self):
+        grail_position = self.find_spawn_position(config.TERRAIN_SIZES["holy_grail"])
+        if grail_position is None:
+            return
+        for grail in self.terrain_index.grails:
+            self.terrain_index.move(grail, grail_position)
+
+    def is_position_occupied_by_mushroom(self, position):
+        return self.terrain_index.has_mushroom(position)
+
+    def check_collision(self, obj_position, obj_size, increment=0, self_id=-1):
+        # Skips the `increment` newest segments of every snake and all segments of `self_id`
+        if self.polyline_collisions and not increment:
+            return {owner: True for owner, snake in self.snakes.items()
+                    if owner != self_id and snake.path.collides(obj_position, obj_size, snake.block_size)}
+        hits = self.snake_index.query(obj_position, obj_size, exclude=self_id, min_age=increment)
+        # Keep the join order, the first colliding snake wins food and bonuses
+        return {owner: True for owner in self.snakes if owner in hits}
+
+    def check_object_collision(self, obj, precomputed):
+        # Objects spawned during this tick are missing from the batch and are checked one by one
+        entry = precomputed.get(id(obj))
+        if entry is not None and entry[0] is obj:
+            return entry[1]
+        return self.check_collision(obj.position, obj.size)
+
+    def check_collision_with_terrain(self, obj_position, obj_size):
+        return self.terrain_index.collides_with_wall(obj_position, obj_size)
+
+    def check_snake_head_collisions(self):
+        collisions = {}
+        for owner, snake in self.snakes.items():
+            if not snake.body:
+                continue
+            if self.check_collision(snake.body[0], snake.block_size, self_id=owner):
+                collisions[owner] = True
+        return collisions
+
+    def check_self_collisions(self):
+        collisions = {}
+        for owner, snake in self.snakes.items():
+            # Only body parts more than SELF_COLLISION_NECK_LENGTH behind the head count
+            if snake.body and self.self_index.collides(owner, snake.body[0], snake.block_size):
+                collisions[owner] = True
+        return collisions
+
+    def check_edge_collision(self, snake):
+        head_x, head_y = snake.body[0]
+        return head_x < 0 or head_x >= self.width or head_y < 0 or head_y >= self.height - self.panel_height - 2
+
+    def apply_bonus_effect(self, snake, bonus):
+        if bonus.type == "speed_up":
+            snake.speed_up()
+        elif bonus.type == "add_points":
+            snake.points += config.BONUS_POINTS
+        elif bonus.type == "slow_down":
+            snake.slow_down()
+
+    def apply_terrain_effect(self, snake, terrain):
+        if terrain.type == "slow_down":
+            snake.slow_down(config.TERRAIN_SLOW_RATE)
+
+        if terrain.type == "speed_up":
+            snake.speed_up(config.TERRAIN_SPEEDUP_RATE)
+
+        if terrain.type == "wall":
+            snake.lost = True
+
+        if terrain.type == "mushroom":
+            snake.trip(self.rng)
+
+        if terrain.type == "holy_grail":
+            snake.points += config.HOLY_GRAIL_ADD
+
+    def step(self):
+        """Advance the world by one tick. Returns the owners whose snake lost on this tick."""
+        self.ticks += 1
+        already_lost = {owner for owner, snake in self.snakes.items() if snake.lost}
+        for snake in self.snakes.values():
+            snake.update()
+
+        if self.self_collision:
+            for owner in self.check_self_collisions():
+                self.snakes[owner].lost = True
+
+        # Bodies do not move again until the next tick, so every overlap can be resolved up front
+        batch = None
+        precomputed = {}
+        if self.vectorized_collisions:
+            batch = vector_collision.CollisionBatch(self.snakes)
+            precomputed = batch.object_collisions(self.foods + self.bonuses + self.terrains)
+
+        for food in self.foods:
+            food_collisions = self.check_object_collision(food, precomputed)
+            if food_collisions:
+                first_key = next(iter(food_collisions))  # host advantage hehe
+                self.snakes[first_key].grow(config.SNAKE_GROWTH_RATE)
+                self.snakes[first_key].points += 1
+                self.foods.remove(food)
+                self.spawn_food()
+
+        # Check if a snake has collected a bonus, apply the bonus effect and remove it from the list
+        for bonus in self.bonuses:
+            bonus_collision = self.check_object_collision(bonus, precomputed)
+            if bonus_collision:
+                first_key = next(iter(bonus_collision))  # host advantage fr
+                self.apply_bonus_effect(self.snakes[first_key], bonus)
+                self.bonuses.remove(bonus)
+                if self.single_bonus:
+                    break
+
+        # Check if a snake is on a terrain tile and apply the terrain effect
+        for terrain in self.terrains:
+            for owner in self.check_object_collision(terrain, precomputed):
+                self.apply_terrain_effect(self.snakes[owner], terrain)
+
+        current_time = self.elapsed
+        if current_time - self.grail_spawn_timer > config.GRAIL_CHANGE_TIME:
+            self.move_grail()
+            self.grail_spawn_timer = current_time
+
+        if current_time - self.shroom_spawn_timer > config.MUSHROOM_GROW_TIME:
+            self.grow_mushroom()
+            self.shroom_spawn_timer = current_time
+
+        # Spawn a bonus after a certain time
+        if current_time - self.bonus_spawn_timer > self.bonus_spawn_interval:
+            self.spawn_bonus()
+            self.bonus_spawn_timer = current_time
+
+        collisions = batch.head_collisions() if batch is not None else self.check_snake_head_collisions()
+        for owner in collisions:
+            self.snakes[owner].lost = True
+
+        if self.edge_collision:
+            for snake in self.snakes.values():
+                if snake.body and self.check_edge_collision(snake):
+                    snake.lost = True
+
+        return [owner for owner, snake in self.snakes.items() if snake.lost and owner not in already_lost]
+
+
+def benchmark(level_number=config.DEFAULT_LEVEL, ticks=10000, snakes=4, body_length=3000):
+    # Headless fast-forward with wandering snakes, prints simulation ticks per second.
+    # The snakes first grow body_length segments untimed, the case the body indexes are built for
+    import time
+    world = World()
+    world.load_level(level_number)
+    for owner in range(snakes):
+        snake = Snake(start_pos=(config.SCREEN_WIDTH // 2, 2 * config.SNAKE_SIZE * (owner + 1)))
+        snake.grow(body_length)
+        world.add_snake(owner, snake)
+    world.spawn_food()
+    directions = [config.UP, config.DOWN, config.LEFT, config.RIGHT]
+
+    def play(tick):
+        for snake in world.snakes.values():
+            if tick % 60 == 0:
+                snake.change_direction(random.choice(directions))
+            snake.lost = False  # Keep everyone playing, only the cost of the rules is measured
+        world.step()
+
+    for tick in range(body_length):
+        play(tick)
+    started = time.perf_counter()
+    for tick in range(ticks):
+        play(tick)
+    elapsed = time.perf_counter() - started
+    print(f"{ticks} ticks in {elapsed:.2f}s: {ticks / elapsed:.0f} ticks/s, "
+          f"{sum(len(snake.body) for snake in world.snakes.values())} segments")
+
+
+if __name__ == "__main__":
+    benchmark()
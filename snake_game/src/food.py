@@ -1,5 +1,3 @@
-import pygame
-from .drawing import draw_food
 from . import config
 
 class Food:
@@ -9,6 +7,7 @@ class Food:
         self.position = position
 
     def draw(self, screen):
+        from .drawing import draw_food
         draw_food(screen, self.position, self.size)
     def get_food_data(self):
         return {
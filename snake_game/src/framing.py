@@ -0,0 +1,54 @@
+from . import protocol
+from . import config
+
+
+class FrameReader:
+    """Reads framed messages from a blocking socket into one reusable buffer.
+
+    recv_into() fills the buffer with whatever has arrived, often several
+    frames at once, and frames are handed out as memoryviews over it rather
+    than copied. The buffer only grows when a frame does not fit.
+    """
+
+    def __init__(self, sock, size=config.BYTES_RECV):
+        self.sock = sock
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # First byte not handed out yet
+        self.end = 0  # End of the received bytes
+
+    def read_frame(self):
+        """Payload of the next frame, a view that stays valid until the next call."""
+        self.fill(protocol.HEADER_SIZE)
+        length = protocol.decode_header(self.view[self.start:self.start + protocol.HEADER_SIZE])
+        self.start += protocol.HEADER_SIZE
+        self.fill(length)
+        payload = self.view[self.start:self.start + length]
+        self.start += length
+        return payload
+
+    def buffered(self):
+        # Received bytes not handed out yet, a socket that is not readable may still have a frame here
+        return self.end - self.start
+
+    def fill(self, needed):
+        # Receive until at least needed unread bytes are buffered
+        pending = self.end - self.start
+        if pending >= needed:
+            return
+        if not pending:
+            self.start = self.end = 0
+        if self.start + needed > len(self.buffer):
+            # Move the unread tail to the front, into a larger buffer if the frame would not fit
+            if needed > len(self.buffer):
+                buffer = bytearray(max(needed, 2 * len(self.buffer)))
+                buffer[:pending] = self.view[self.start:self.end]
+                self.buffer, self.view = buffer, memoryview(buffer)
+            else:
+                self.view[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+        while self.end - self.start < needed:
+            received = self.sock.recv_into(self.view[self.end:])
+            if not received:
+                raise EOFError('Socket closed before receiving all data')
+            self.end += received
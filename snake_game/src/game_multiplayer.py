@@ -45,12 +45,15 @@ class GameMultiplayer:
                 foods_data = game_state['foods']
                 bonuses_data = game_state['bonuses']
                 points_to_complete = game_state['points_to_complete']
-                start_time = game_state['start_time']
+                start_time = pygame.time.get_ticks() - game_state['elapsed']
 
                 foods = [Food(food_data['position']) for food_data in foods_data]
                 bonuses = [Bonus(bonus_data['position'], bonus_data['type']) for bonus_data in bonuses_data]
                 terrains = [Terrain(terrain_data['position'], terrains_data['type']) for terrain_data in terrains_data]
-                snakes = {client_id: Snake.from_data(snake_data) for client_id, snake_data in snakes_data.items()} 
+                if self.client.view is not None:
+                    snakes = self.client.view.snakes()  # Ours predicted, the others interpolated
+                else:
+                    snakes = {client_id: Snake.from_data(snake_data) for client_id, snake_data in snakes_data.items()} 
 
                 draw_game_multiplayer(self.screen, terrains, snakes, foods, bonuses, points_to_complete, start_time, self.client.player_id)
             self.clock.tick(config.CLOCK_TICK)
@@ -68,6 +71,15 @@ class GameMultiplayer:
             self.game_state_updater_thread = None
 
     def update_game_state_loop(self):
+        if config.PUSH_GAME_STATE:
+            # The server streams one snapshot per tick, only inputs go the other way
+            self.client.subscribe()
+            while self.updating_game_state:
+                self.client.receive_game_state()
+                if self.client.game_state is not None and self.client.game_state.get('action') == 'game_over':
+                    break
+            return
+
         while self.updating_game_state:
             self.client.request_game_state()
             time.sleep(0.005)  # Update game state every 5 ms
@@ -76,7 +88,7 @@ class GameMultiplayer:
         """
         Handles the game over scenario based on the reason.
         
-        :param reason: 'you_lost', 'host_lost', 'win', or 'server_closed'
+        :param reason: 'you_lost', 'host_lost', 'win', 'server_closed' or 'desync'
         """
         self.stop_game_state_updater()
         if reason == "you_lost":
@@ -87,6 +99,8 @@ class GameMultiplayer:
             message = "Congratulations! You Won!"
         elif reason == "server_closed":
             message = "Game Over! Server has closed the game."
+        elif reason == "desync":
+            message = "Game Over! Lost sync with the server."
         else:
             message = "Game Over!"
 
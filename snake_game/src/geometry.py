@@ -0,0 +1,10 @@
+def square_rect(position, size):
+    # Same integer (x, y, w, h) that pygame.Rect builds for a square centred on position
+    half = size // 2
+    return (int(position[0] - half), int(position[1] - half), size, size)
+
+
+def rects_collide(rect, other):
+    # Matches pygame.Rect.colliderect for rects with positive width and height
+    return (rect[0] < other[0] + other[2] and other[0] < rect[0] + rect[2]
+            and rect[1] < other[1] + other[3] and other[1] < rect[1] + rect[3])
@@ -0,0 +1,29 @@
+import os
+import glob
+import hashlib
+from . import config
+
+
+def level_hash(level_bytes):
+    # Levels are identified by the content of their JSON file, so any edit gives a new identity
+    return hashlib.sha256(level_bytes).hexdigest()
+
+
+def load_cached_level(wanted_hash):
+    """JSON bytes of the level with this hash from the cache or the bundled levels, None if neither has it."""
+    candidates = [os.path.join(config.LEVEL_CACHE_DIR, f"{wanted_hash}.json")]
+    candidates += sorted(glob.glob("snake_game/levels/level_*.json"))
+    for path in candidates:
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as file:
+            level_bytes = file.read()
+        if level_hash(level_bytes) == wanted_hash:
+            return level_bytes
+    return None
+
+
+def store_level(level_bytes):
+    os.makedirs(config.LEVEL_CACHE_DIR, exist_ok=True)
+    with open(os.path.join(config.LEVEL_CACHE_DIR, f"{level_hash(level_bytes)}.json"), "wb") as file:
+        file.write(level_bytes)
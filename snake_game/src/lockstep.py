@@ -0,0 +1,107 @@
+from .engine import World
+from . import config
+
+
+class Lockstep:
+    """A lockstep client's own copy of the match, advanced by the events the server relays.
+
+    The world draws every random choice from its own generator and counts
+    time in ticks, so peers that apply the same joins and direction changes
+    before the same ticks hold the same world. A joining client starts from
+    the server's last world checkpoint, after that only events cross the
+    network, a few bytes per input whatever the snake lengths. The world hash
+    is reported every config.LOCKSTEP_HASH_INTERVAL ticks so the server can
+    tell when a peer has drifted.
+    """
+
+    def __init__(self, checkpoint, level_bytes):
+        # The level's walls come from its file, what moved since then comes from the checkpoint
+        self.world = World(vectorized_collisions=config.VECTORIZED_COLLISIONS, polyline_collisions=config.POLYLINE_COLLISIONS)
+        self.world.load_level_data(level_bytes)
+        self.world.restore(checkpoint)
+
+    def replay(self, tick, log):
+        # Catch up from the checkpoint to the server's tick, log lists only the ticks that had events
+        events_by_tick = dict(log)
+        while self.world.ticks < tick:
+            self.advance(self.world.ticks + 1, events_by_tick.get(self.world.ticks + 1, []))
+
+    def advance(self, tick, events):
+        """Apply a tick's events and step into it. Raises ValueError when ticks were skipped."""
+        if tick <= self.world.ticks:
+            return  # Already in the log this client replayed
+        if tick != self.world.ticks + 1:
+            raise ValueError(f"Tick {tick} arrived at tick {self.world.ticks}")
+        for event in events:
+            self.world.apply_event(event)
+        self.world.step()
+
+    def hash_due(self):
+        return self.world.ticks % config.LOCKSTEP_HASH_INTERVAL == 0
+
+    def game_state(self):
+        # The world in the shape snapshots have, for drawing and input handling
+        world = self.world
+        return {
+            'terrains': [terrain.get_terrain_data() for terrain in world.terrains],
+            'snakes': {owner: snake.get_snake_data() for owner, snake in world.snakes.items() if not snake.lost},
+            'foods': [food.get_food_data() for food in world.foods],
+            'bonuses': [bonus.get_bonus_data() for bonus in world.bonuses],
+            'points_to_complete': world.points_to_complete,
+            'elapsed': world.elapsed,
+        }
+
+
+def compare(levels=(1, 2, 3, 4, 5), ticks=3000, snakes=6, seed=0):
+    # A scripted match played the way BaseServer plays it, with one peer there from the start and one joining halfway
+    # from the last checkpoint; peers must report the server's hash, prints one line per level and exits on a difference
+    import random
+    from . import protocol
+
+    def relay(message):
+        # Through the binary format, as the server sends it
+        return protocol.decode_binary(protocol.encode_binary(message))
+
+    directions = [config.UP, config.DOWN, config.LEFT, config.RIGHT]
+    for level_number in levels:
+        with open(f"snake_game/levels/level_{level_number}.json", "rb") as file:
+            level_bytes = file.read()
+        world = World(vectorized_collisions=config.VECTORIZED_COLLISIONS, polyline_collisions=config.POLYLINE_COLLISIONS, seed=seed)
+        world.load_level_data(level_bytes)
+        world.spawn_food()
+        checkpoint, log = world.checkpoint(), []
+        peers = [Lockstep(checkpoint, level_bytes)]
+        script = random.Random(level_number)
+        joined = 0
+        for tick in range(1, ticks + 1):
+            # Lost snakes leave and new players take their place, so events keep coming after the late join
+            events = [('leave', owner, 0, 0) for owner, snake in world.snakes.items() if snake.lost]
+            playing = len(world.snakes) - len(events)
+            for _ in range(snakes - playing):
+                start_y = script.randint(2 * config.SNAKE_SIZE, config.SCREEN_HEIGHT - config.SNAKE_SIZE)
+                events.append(('join', joined, 2 * config.SNAKE_SIZE, start_y))
+                joined += 1
+            events += [('direction', owner, *script.choice(directions)) for owner in world.snakes if script.random() < 0.02]
+            for event in events:
+                world.apply_event(event)
+            world.step()
+            if events:
+                log.append((tick, events))
+            _, tick, events = relay(('tick', tick, events))
+            for peer in peers:
+                peer.advance(tick, events)
+            if tick % config.LOCKSTEP_CHECKPOINT_INTERVAL == 0:
+                checkpoint, log = world.checkpoint(), []
+            if tick == ticks // 2:
+                _, tick, late_checkpoint, late_log = relay(('lockstep', tick, checkpoint, log))
+                peers.append(Lockstep(late_checkpoint, level_bytes))
+                peers[-1].replay(tick, late_log)
+                replayed = len(late_log)
+            if tick % config.LOCKSTEP_HASH_INTERVAL == 0 and any(peer.world.state_hash() != world.state_hash() for peer in peers):
+                raise SystemExit(f"Level {level_number}: a lockstep peer differs from the server at tick {tick}")
+        print(f"Level {level_number}: {len(peers)} peers identical after {ticks} ticks, {joined} joins, "
+              f"the late peer replayed {replayed} logged ticks")
+
+
+if __name__ == "__main__":
+    compare()
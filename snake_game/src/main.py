@@ -13,6 +13,7 @@ from src.color_selection import ColorSelection
 from src.menu import Menu
 from src.menu import MultiplayerMenu
 from src.server import Server
+from src.async_server import AsyncServer
 from src.client import Client
 from . import config
 
@@ -42,7 +43,8 @@ def main():
             multiplayer_action = multiplayer_menu.run()
             if multiplayer_action == 'Host':
                 ip = input("Enter the server IP address: ")
-                server = Server(ip) #for local network
+                server_class = AsyncServer if config.ASYNC_SERVER else Server
+                server = server_class(ip) #for local network
                 server_thread = threading.Thread(target=server.run)
                 server_thread.start()
                 time.sleep(0.5)
@@ -1,25 +1,88 @@
 import socket
+import select
 import pickle
-import logging
-from .config import BYTES_RECV, MAGIC_NUMBER
+from .config import SERVER_PORT
+from . import config
+from . import protocol
+from .framing import FrameReader
+from .datagram import open_channel
+from collections import deque
 import threading
 
 
 class Network:
-    def __init__(self, ip):
+    def __init__(self, ip, port=SERVER_PORT):
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if config.TCP_NODELAY:
+            self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.server = ip
-        self.port = 5432  # Choose an appropriate port number
+        self.port = port
         self.addr = (self.server, self.port)
         self.client.connect(self.addr)
         self.connected = True
+        self.frames = FrameReader(self.client)
         self.send_lock = threading.Lock()
         self.recv_lock = threading.Lock()
+        self.version = protocol.PICKLE_VERSION  # Wire format of outgoing messages, raised by negotiate()
+        self.level_hash = None  # Level the server runs, from its hello reply
+        self.udp = None  # DatagramChannel once open_udp() succeeds
+        self.udp_token = 0
+        self.inputs = deque(maxlen=config.UDP_INPUT_REDUNDANCY)  # Latest directions, newest first, resent in every datagram
+        self.input_seq = 0
+        self.acked = 0  # Last applied snapshot, reported in every datagram
+
+    def negotiate(self):
+        # Offer the binary protocol; servers that know it answer with the version to use
+        self.version = protocol.BINARY_VERSION
+        self.send_data(('hello', protocol.BINARY_VERSION))
+        reply = self.recv_data()
+        if isinstance(reply, tuple) and reply[0] == 'hello':
+            self.version = reply[1]
+            self.level_hash = reply[2] if len(reply) > 2 else None
+        else:
+            self.version = protocol.PICKLE_VERSION
+        return self.version
 
     def get_player_id(self):
         player_id = self.recv_data()
         return int(player_id)
 
+    def open_udp(self):
+        # Ask for a UDP token over TCP; with one, snapshots and inputs go as datagrams to the same port
+        self.send_data(('request_udp',))
+        reply = self.recv_data()
+        if isinstance(reply, tuple) and reply[0] == 'udp' and reply[1]:
+            self.udp_token = reply[1]
+            self.udp = open_channel(self.addr)
+        return self.udp is not None
+
+    def send_inputs(self, player_id, direction=None):
+        # One datagram with the newest direction and the few before it, so a lost datagram loses no input
+        with self.send_lock:
+            if direction is not None:
+                self.input_seq += 1
+                self.inputs.appendleft(direction)
+            message = protocol.encode_message(('input', player_id, self.udp_token, self.acked, self.input_seq, list(self.inputs)), self.version)
+        self.udp.send(message)
+
+    def recv_any(self, timeout):
+        """The next message from the TCP stream or the UDP socket, None if nothing valid arrived within timeout."""
+        if not self.frames.buffered():
+            readable, _, _ = select.select([self.client, self.udp.sock], [], [], timeout)
+            if not readable:
+                return None
+            if self.client not in readable:
+                try:
+                    return self.udp.recv()[0]
+                except OSError:
+                    return None  # The server is gone, the TCP stream reports it
+        return self.recv_data()
+
+    def get_level(self):
+        # Static level data, asked for once when it is not in the local cache
+        self.send_data(('request_level',))
+        return self.recv_data()
+
     def get_game_state(self):
         try:
             self.send_data(('request_game_state',))
@@ -35,39 +98,21 @@ class Network:
             return
         try:
             with self.send_lock:
-                message = pickle.dumps(data)
-                message_length = len(message)
-                #logging.debug(f"Sending data: Length={message_length}, Data={data}")
-                self.client.sendall(MAGIC_NUMBER)
-                self.client.sendall(message_length.to_bytes(4, 'big'))
+                message = protocol.encode_message(data, self.version)
+                #logging.debug(f"Sending data: Length={len(message)}, Data={data}")
                 self.client.sendall(message)
         except socket.error as e:
             print(f"Socket error during send: {e}")
             self.connected = False
-        except pickle.PickleError as e:
-            print(f"Pickle error during send: {e}")
+        except (pickle.PickleError, ValueError) as e:
+            print(f"Encoding error during send: {e}")
             self.connected = False
 
-    def recvall(self, length):
-        data = b''
-        while len(data) < length:
-            more = self.client.recv(length - len(data))
-            if not more:
-                raise EOFError('Socket closed before receiving all data')
-            data += more
-        return data
-
     def recv_data(self):
         try:
             with self.recv_lock:
-                received_magic = self.recvall(4)
-                if received_magic != MAGIC_NUMBER:
-                    raise ValueError("Invalid magic number received.")
-                message_length = int.from_bytes(self.recvall(4), 'big')
-                if message_length <= 0 or message_length > 10**6:
-                    raise ValueError(f"Invalid message length: {message_length}")
-                data = self.recvall(message_length)
-                received_data = pickle.loads(data)
+                # Pickle only before negotiating (the player id) or with a server that never negotiated, it can run code when loaded
+                received_data = protocol.decode_message(self.frames.read_frame(), allow_pickle=self.version == protocol.PICKLE_VERSION)
                 #print(f"Received data: {received_data}")
                 return received_data
         except (pickle.UnpicklingError, ValueError, EOFError, socket.error) as e:
@@ -76,3 +121,40 @@ class Network:
             self.connected = False
             return {'action': 'game_over', 'reason': 'server_closed'}
 
+
+def benchmark(rounds=200):
+    # Round trips to a local threaded server with and without TCP_NODELAY, prints median and 95th percentile
+    import time
+    from .server import Server
+    saved = config.TCP_NODELAY
+    directions = (config.RIGHT, config.DOWN, config.LEFT, config.UP)  # Circle in place so the snake stays alive
+    try:
+        for nodelay in (False, True):
+            config.TCP_NODELAY = nodelay  # Read by both ends when their sockets are set up
+            server = Server('127.0.0.1', 0)
+            server_thread = threading.Thread(target=server.run)
+            server_thread.start()
+            network = Network('127.0.0.1', server.server.getsockname()[1])
+            player_id = network.get_player_id()
+            network.negotiate()
+            round_trips = []
+            for turn in range(rounds):
+                # A direction change followed by a request, the pattern Nagle holds back until the first is acknowledged
+                network.send_data(('update_direction', player_id, directions[turn % len(directions)]))
+                started = time.perf_counter()
+                network.get_game_state()
+                round_trips.append(time.perf_counter() - started)
+            network.send_data(('disconnecting', player_id))
+            network.client.close()
+            server.running = False
+            server_thread.join()
+            round_trips.sort()
+            print(f"TCP_NODELAY {'on ' if nodelay else 'off'}: median {1000 * round_trips[len(round_trips) // 2]:.2f} ms, "
+                  f"95th percentile {1000 * round_trips[int(len(round_trips) * 0.95)]:.2f} ms")
+    finally:
+        config.TCP_NODELAY = saved
+
+
+if __name__ == "__main__":
+    # Loopback latency: python -m snake_game.src.network
+    benchmark()
@@ -0,0 +1,154 @@
+import random
+from array import array
+from . import config
+
+
+class OccupancyGrid:
+    """Coarse bitmap of the playfield telling which cells are blocked by walls or snakes.
+
+    Snakes keep it up to date through attach(), like the spatial hash, and walls
+    are marked once per level. Spawning samples only among cells whose
+    neighbourhood is clear, so a position is found in bounded time, or None is
+    returned when the board is full.
+    """
+
+    def __init__(self, width, height, cell_size=config.OCCUPANCY_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cols = width // cell_size + 1
+        self.rows = height // cell_size + 1
+        self.snake_counts = array('i', bytes(4 * self.cols * self.rows))  # Segment centres per cell
+        self.walls = bytearray(self.cols * self.rows)
+        self.wall_table = self.summed_table(self.walls)
+        self.block_sizes = {}
+        self.owner_cells = {}  # owner -> {cell: segment count}, so a whole snake can be taken out
+
+    def cell_of(self, point):
+        # Points off the board count against the nearest border cell
+        col = min(max(int(point[0] // self.cell_size), 0), self.cols - 1)
+        row = min(max(int(point[1] // self.cell_size), 0), self.rows - 1)
+        return row * self.cols + col
+
+    def set_walls(self, terrains):
+        self.walls = bytearray(self.cols * self.rows)
+        for terrain in terrains:
+            if terrain.type != "wall":
+                continue
+            half = terrain.size // 2
+            first_col, first_row = self.clamp(terrain.position[0] - half, terrain.position[1] - half)
+            last_col, last_row = self.clamp(terrain.position[0] + half, terrain.position[1] + half)
+            for row in range(first_row, last_row + 1):
+                for col in range(first_col, last_col + 1):
+                    self.walls[row * self.cols + col] = 1
+        self.wall_table = self.summed_table(self.walls)
+
+    def clamp(self, x, y):
+        col = min(max(int(x // self.cell_size), 0), self.cols - 1)
+        row = min(max(int(y // self.cell_size), 0), self.rows - 1)
+        return col, row
+
+    def add_body(self, owner, body, block_size):
+        self.block_sizes[owner] = block_size
+        self.owner_cells.setdefault(owner, {})
+        for point in body:
+            self.add_segment(owner, None, point)
+
+    def remove_owner(self, owner):
+        for cell, count in self.owner_cells.pop(owner, {}).items():
+            self.snake_counts[cell] -= count
+        self.block_sizes.pop(owner, None)
+
+    def add_segment(self, owner, seq, point):
+        cell = self.cell_of(point)
+        self.snake_counts[cell] += 1
+        cells = self.owner_cells[owner]
+        cells[cell] = cells.get(cell, 0) + 1
+
+    def remove_segment(self, owner, seq, point):
+        cell = self.cell_of(point)
+        self.snake_counts[cell] -= 1
+        cells = self.owner_cells[owner]
+        cells[cell] -= 1
+        if not cells[cell]:
+            del cells[cell]
+
+    def summed_table(self, cells):
+        # (rows + 1) x (cols + 1) summed-area table of non-zero cells, for O(1) window queries
+        width = self.cols + 1
+        table = array('i', bytes(4 * width * (self.rows + 1)))
+        for row in range(self.rows):
+            running = 0
+            for col in range(self.cols):
+                running += 1 if cells[row * self.cols + col] else 0
+                table[(row + 1) * width + col + 1] = table[row * width + col + 1] + running
+        return table
+
+    def window_sum(self, table, first_col, first_row, last_col, last_row):
+        first_col, first_row = max(first_col, 0), max(first_row, 0)
+        last_col, last_row = min(last_col, self.cols - 1), min(last_row, self.rows - 1)
+        width = self.cols + 1
+        return (table[(last_row + 1) * width + last_col + 1] - table[first_row * width + last_col + 1]
+                - table[(last_row + 1) * width + first_col] + table[first_row * width + first_col])
+
+    def reaches(self, size):
+        # How many cells around a centre cell a square of `size` can touch, for snakes and for walls
+        snake_reach = -(-(size // 2 + max(self.block_sizes.values(), default=0) // 2 + 2) // self.cell_size)
+        wall_reach = -(-(size // 2 + 1) // self.cell_size)
+        return snake_reach, wall_reach
+
+    def is_cell_clear(self, col, row, size):
+        snake_reach, wall_reach = self.reaches(size)
+        if self.window_sum(self.wall_table, col - wall_reach, row - wall_reach, col + wall_reach, row + wall_reach):
+            return False
+        for window_row in range(max(row - snake_reach, 0), min(row + snake_reach, self.rows - 1) + 1):
+            start = window_row * self.cols
+            for window_col in range(max(col - snake_reach, 0), min(col + snake_reach, self.cols - 1) + 1):
+                if self.snake_counts[start + window_col]:
+                    return False
+        return True
+
+    def free_cells(self, size, min_x, min_y, max_x, max_y):
+        """Every cell in which any centre keeps a square of `size` clear of walls and snakes."""
+        snake_table = self.summed_table(self.snake_counts)
+        snake_reach, wall_reach = self.reaches(size)
+        first_col, first_row = self.clamp(min_x, min_y)
+        last_col, last_row = self.clamp(max_x, max_y)
+        cells = []
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                if self.window_sum(self.wall_table, col - wall_reach, row - wall_reach, col + wall_reach, row + wall_reach):
+                    continue
+                if self.window_sum(snake_table, col - snake_reach, row - snake_reach, col + snake_reach, row + snake_reach):
+                    continue
+                cells.append((col, row))
+        return cells
+
+    def position_in_cell(self, col, row, min_x, min_y, max_x, max_y, rng):
+        low_x, low_y = max(col * self.cell_size, min_x), max(row * self.cell_size, min_y)
+        high_x, high_y = min((col + 1) * self.cell_size - 1, max_x), min((row + 1) * self.cell_size - 1, max_y)
+        if low_x > high_x or low_y > high_y:
+            return None
+        return (rng.randint(low_x, high_x), rng.randint(low_y, high_y))
+
+    def find_free_position(self, size, min_x, min_y, max_x, max_y, is_free=None, rng=random):
+        """Random integer position in [min, max] whose square of `size` is free, or None if there is none.
+
+        A few random cells are tried first, which is enough on an open board. After that the
+        free cells are listed once and sampled without replacement, so the search always ends.
+        `is_free` is an exact check run on each chosen position.
+        """
+        first_col, first_row = self.clamp(min_x, min_y)
+        last_col, last_row = self.clamp(max_x, max_y)
+        for _ in range(config.SPAWN_RANDOM_TRIES):
+            col, row = rng.randint(first_col, last_col), rng.randint(first_row, last_row)
+            if self.is_cell_clear(col, row, size):
+                position = self.position_in_cell(col, row, min_x, min_y, max_x, max_y, rng)
+                if position is not None and (is_free is None or is_free(position)):
+                    return position
+
+        cells = self.free_cells(size, min_x, min_y, max_x, max_y)
+        while cells:
+            col, row = cells.pop(rng.randrange(len(cells)))
+            position = self.position_in_cell(col, row, min_x, min_y, max_x, max_y, rng)
+            if position is not None and (is_free is None or is_free(position)):
+                return position
+        return None
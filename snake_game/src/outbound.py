@@ -0,0 +1,78 @@
+import threading
+from collections import deque
+from . import config
+
+
+class OutboundQueue:
+    """Encoded frames waiting for one client's writer.
+
+    The tick and the reader only queue frames, so a slow peer never blocks
+    them. When the queue is full the oldest state frame goes: a newer
+    snapshot replaces it anyway. put() reports a client to disconnect when
+    the queue holds nothing but control messages, or when too many state
+    frames were dropped before its writer caught up. Frames queued with
+    flush=False wait for flush(), so a tick's messages leave in one write.
+    """
+
+    def __init__(self, size=config.OUTBOUND_QUEUE_SIZE, drop_limit=config.SLOW_CLIENT_DROPS):
+        self.frames = deque()  # (message, is a state frame)
+        self.size = size
+        self.drop_limit = drop_limit
+        self.dropped = 0  # State frames dropped since the writer last emptied the queue
+        self.ready = False  # Frames are queued and flushed, the writer should send them
+        self.closed = False
+        self.condition = threading.Condition()
+        self.on_flush = None  # Called on each flush, the asyncio writer wakes on it
+
+    def put(self, message, state=False, flush=True):
+        """Queue a frame. Returns False when the client has fallen too far behind to keep."""
+        with self.condition:
+            if self.closed:
+                return True
+            if len(self.frames) >= self.size:
+                for index, (_, queued_state) in enumerate(self.frames):
+                    if queued_state:
+                        del self.frames[index]
+                        self.dropped += 1
+                        break
+                else:
+                    return False
+                if self.dropped >= self.drop_limit:
+                    return False
+            self.frames.append((message, state))
+        if flush:
+            self.flush()
+        return True
+
+    def flush(self):
+        # Wake the writer for everything queued so far
+        with self.condition:
+            if not self.frames:
+                return
+            self.ready = True
+            self.condition.notify()
+        if self.on_flush is not None:
+            self.on_flush()
+
+    def take(self):
+        # Everything queued as one buffer for a single write, b'' when empty
+        with self.condition:
+            data = b''.join(message for message, _ in self.frames)
+            self.frames.clear()
+            self.dropped = 0
+            self.ready = False
+            return data
+
+    def wait(self, timeout=None):
+        """Block until frames are flushed; returns b'' once closed and drained."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.ready or self.closed, timeout)
+        return self.take()
+
+    def close(self):
+        # Frames already queued are still handed out, then wait() returns b''
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.on_flush is not None:
+            self.on_flush()
@@ -0,0 +1,73 @@
+import math
+from .geometry import square_rect, rects_collide
+
+
+def direction_of(start, end):
+    # Unit axis direction from start to end, (0, 0) when they coincide
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    return ((dx > 0) - (dx < 0), (dy > 0) - (dy < 0))
+
+
+class PolylineBody:
+    """Snake body kept as its head, its turn points and its tail, plus the total length.
+
+    Snakes only move along the axes, so these vertices describe the same shape
+    as the per-tick point list while their number only grows with the number
+    of turns. Used for compact snapshots, for drawing remote snakes received
+    in that form and, with config.POLYLINE_COLLISIONS, for the world's
+    collision tests, which then cost one rect test per straight run.
+    """
+
+    def __init__(self, vertices, length=None):
+        self.vertices = [tuple(vertex) for vertex in vertices]  # Head first, tail last
+        self.length = length if length is not None else self.measure()
+
+    @classmethod
+    def from_points(cls, points):
+        points = list(points)
+        vertices = points[:1]
+        for previous, point, following in zip(points, points[1:], points[2:]):
+            if direction_of(previous, point) != direction_of(point, following):
+                vertices.append(point)
+        if len(points) > 1:
+            vertices.append(points[-1])
+        return cls(vertices)
+
+    def measure(self):
+        return sum(math.dist(a, b) for a, b in zip(self.vertices, self.vertices[1:]))
+
+    def advance(self, new_head):
+        # Keep moving the head while the direction stays the same, otherwise the old head becomes a turn
+        vertices = self.vertices
+        head = vertices[0]
+        self.length += math.dist(head, new_head)
+        if len(vertices) > 1 and direction_of(vertices[1], head) == direction_of(head, new_head):
+            vertices[0] = tuple(new_head)
+        else:
+            vertices.insert(0, tuple(new_head))
+
+    def trim(self, new_tail):
+        """Pull the tail forward to new_tail, the next point of the body, dropping passed turns."""
+        vertices = self.vertices
+        self.length -= math.dist(vertices[-1], new_tail)
+        while len(vertices) > 2 and direction_of(vertices[-2], new_tail) != direction_of(vertices[-2], vertices[-1]):
+            vertices.pop()
+        vertices[-1] = tuple(new_tail)
+        if len(vertices) == 2 and vertices[0] == vertices[1]:
+            vertices.pop()  # Back to a single point
+
+    def segments(self):
+        if len(self.vertices) == 1:
+            return [(self.vertices[0], self.vertices[0])]
+        return list(zip(self.vertices, self.vertices[1:]))
+
+    def collides(self, obj_position, obj_size, block_size):
+        # Each straight run covers the rect spanned by the squares at its two ends
+        obj_rect = square_rect(obj_position, obj_size)
+        for start, end in self.segments():
+            first, last = square_rect(start, block_size), square_rect(end, block_size)
+            left, top = min(first[0], last[0]), min(first[1], last[1])
+            right, bottom = max(first[0], last[0]) + block_size, max(first[1], last[1]) + block_size
+            if rects_collide(obj_rect, (left, top, right - left, bottom - top)):
+                return True
+        return False
@@ -0,0 +1,138 @@
+import time
+import threading
+from collections import deque
+from .snake import Snake
+from . import config
+
+
+class ClientView:
+    """What a multiplayer client draws: its own snake predicted, the others interpolated.
+
+    A turn only shows up in snapshots a round trip after the key press, so the
+    player's own snake is replayed from the newest snapshot up to the current
+    server tick with Snake.update, applying the inputs no snapshot has
+    confirmed yet. Remote snakes are drawn a few ticks in the past, between
+    the two snapshots around that moment, so uneven arrivals do not make them
+    jump. Snapshots are stamped with their server tick, and the local clock is
+    mapped onto ticks from the fastest delivery seen.
+    """
+
+    def __init__(self, player_id, delay_ticks=config.INTERPOLATION_DELAY_TICKS):
+        self.player_id = player_id
+        self.delay_ticks = delay_ticks
+        self.snapshots = deque(maxlen=config.INTERPOLATION_BUFFER)  # (server tick, game state), oldest first
+        self.clock_offset = None  # Server tick minus local time in ticks
+        self.pending = []  # (server tick it was made at, input seq, direction) for inputs no snapshot shows yet
+        self.lock = threading.Lock()  # Snapshots come from the network thread, frames are drawn on the main one
+
+    def server_tick(self, now=None):
+        now = time.perf_counter() if now is None else now
+        return now * config.SIMULATION_TICK_RATE + self.clock_offset
+
+    def add_snapshot(self, game_state, now=None):
+        now = time.perf_counter() if now is None else now
+        tick = round(game_state['elapsed'] * config.SIMULATION_TICK_RATE / 1000)
+        offset = tick - now * config.SIMULATION_TICK_RATE
+        with self.lock:
+            if self.clock_offset is None or offset > self.clock_offset:
+                self.clock_offset = offset
+            else:
+                self.clock_offset -= 0.01  # Forget the fastest delivery slowly, to follow a slower route or clock drift
+            if self.snapshots and tick <= self.snapshots[-1][0]:
+                return
+            self.snapshots.append((tick, game_state))
+
+            own = game_state['snakes'].get(self.player_id)
+            if own is not None:
+                # The snapshot already shows every input up to the last one the server applied
+                applied = own.get('input_seq', 0)
+                self.pending = [(made, seq, direction) for made, seq, direction in self.pending
+                                if seq > applied and tick - made < config.PREDICTION_INPUT_TIMEOUT * config.SIMULATION_TICK_RATE]
+
+    def add_input(self, seq, direction):
+        with self.lock:
+            if self.clock_offset is not None:
+                self.pending.append((self.server_tick(), seq, direction))
+
+    def direction(self):
+        # Where our snake heads once the server has every input sent so far
+        with self.lock:
+            if self.pending:
+                return self.pending[-1][2]
+            if self.snapshots:
+                own = self.snapshots[-1][1]['snakes'].get(self.player_id)
+                if own is not None:
+                    return own['direction']
+        return None
+
+    def snakes(self, now=None):
+        """Snakes to draw this frame, by client id."""
+        with self.lock:
+            if not self.snapshots:
+                return {}
+            snapshots = list(self.snapshots)
+            pending = list(self.pending)
+            now_tick = self.server_tick(now)
+
+        render_tick = now_tick - self.delay_ticks
+        older = newer = snapshots[-1]
+        for index in range(len(snapshots) - 1, 0, -1):
+            if snapshots[index - 1][0] <= render_tick:
+                older, newer = snapshots[index - 1], snapshots[index]
+                break
+        else:
+            older = newer = snapshots[0]
+
+        snakes = {}
+        for client_id, snake_data in newer[1]['snakes'].items():
+            if client_id != self.player_id:
+                snakes[client_id] = interpolate(older, newer, client_id, render_tick)
+        newest_tick, newest = snapshots[-1]
+        own = newest['snakes'].get(self.player_id)
+        if own is not None:
+            snakes[self.player_id] = predict(own, newest_tick, pending, now_tick)
+        return snakes
+
+
+def predict(snake_data, base_tick, pending, now_tick):
+    # Replay our snake from the snapshot to now with the same rules as the server
+    snake = Snake.from_data(snake_data)
+    if 'body' not in snake_data:
+        return snake
+    steps = min(int(now_tick) - base_tick, config.MAX_PREDICTION_TICKS)
+    for step in range(1, steps + 1):
+        for made, _, direction in pending:
+            if made <= base_tick + step:
+                snake.direction = direction
+        snake.update()
+    if steps < 1 and pending:
+        snake.direction = pending[-1][2]
+    return snake
+
+
+def interpolate(older, newer, client_id, render_tick):
+    # The snake render_tick ticks into the game, between two snapshots. Each tick pushes one head point,
+    # so going back in time slides every point towards the tail along the body, into the older snapshot's tail.
+    (tick0, state0), (tick1, state1) = older, newer
+    data1 = state1['snakes'][client_id]
+    data0 = state0['snakes'].get(client_id)
+    snake = Snake.from_data(data1)
+    if data0 is None or 'body' not in data0 or 'body' not in data1 or tick1 <= tick0:
+        return snake
+    pushed = tick1 - tick0
+    back = min(max(tick1 - render_tick, 0), pushed)
+    if back == 0:
+        return snake
+
+    body1, body0 = data1['body'], data0['body']
+    trail = list(body1) + list(body0[max(len(body1) - pushed, 0):])  # Points the older snapshot still had past the tail
+    whole, fraction = int(back), back - int(back)
+    last = len(trail) - 1
+    points = []
+    for index in range(len(body1)):
+        first = min(index + whole, last)
+        second = min(first + 1, last)
+        (x0, y0), (x1, y1) = trail[first], trail[second]
+        points.append((x0 + (x1 - x0) * fraction, y0 + (y1 - y0) * fraction))
+    snake.body = points
+    return snake
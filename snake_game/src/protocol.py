@@ -0,0 +1,453 @@
+import sys
+import pickle
+import struct
+from array import array
+from itertools import chain
+from .snake_body import SnakeBody
+from . import config
+
+# Every message is MAGIC_NUMBER, a 4-byte big-endian payload length, then the payload
+HEADER_SIZE = 8
+MAX_MESSAGE_SIZE = 10**6
+
+# Payloads are pickles (version 0, what older clients speak) or binary messages. A binary payload
+# starts with BINARY_MARKER, which no pickle starts with, then its version and message kind.
+PICKLE_VERSION = 0
+BINARY_VERSION = 1  # Raised whenever a released binary format changes
+LOCKSTEP_MIN_VERSION = 1  # Clients ask for lockstep and servers grant it from this version on
+BINARY_MARKER = 0xB5
+PREFIX = struct.Struct('<BBB')
+
+(HELLO, PLAYER_ID, UPDATE_DIRECTION, REQUEST_GAME_STATE, SUBSCRIBE, DISCONNECTING, GAME_STATE, GAME_OVER,
+ DELTA, ACK, REQUEST_KEYFRAME, LEVEL, REQUEST_LEVEL, INPUT, REQUEST_UDP, UDP,
+ REQUEST_LOCKSTEP, LOCKSTEP, TICK, STATE_HASH) = range(1, 21)
+CLIENT_MESSAGES = {'update_direction': UPDATE_DIRECTION, 'request_game_state': REQUEST_GAME_STATE,
+                   'subscribe': SUBSCRIBE, 'disconnecting': DISCONNECTING, 'ack': ACK, 'request_keyframe': REQUEST_KEYFRAME}
+CLIENT_KINDS = {SUBSCRIBE: 'subscribe', DISCONNECTING: 'disconnecting', ACK: 'ack', REQUEST_KEYFRAME: 'request_keyframe'}  # One u32 argument
+FROM_CLIENT = frozenset((HELLO, UPDATE_DIRECTION, REQUEST_GAME_STATE, SUBSCRIBE, DISCONNECTING, ACK, REQUEST_KEYFRAME,
+                         REQUEST_LEVEL, INPUT, REQUEST_UDP, REQUEST_LOCKSTEP, STATE_HASH))  # Kinds a server accepts
+LOCKSTEP_KINDS = frozenset((REQUEST_LOCKSTEP, LOCKSTEP, TICK, STATE_HASH))  # Only valid from LOCKSTEP_MIN_VERSION on
+
+# Arguments of each message a client may send: the required ones, then the optional ones
+DIRECTION_ARG, DIRECTIONS_ARG = 'direction', 'directions'
+CLIENT_MESSAGE_ARGS = {
+    'hello': ((int,), ((str, type(None)),)),
+    'update_direction': ((int, DIRECTION_ARG), (int,)),
+    'request_game_state': ((), ()),
+    'subscribe': ((int,), ()),
+    'disconnecting': ((int,), ()),
+    'ack': ((int,), ()),
+    'request_keyframe': ((int,), ()),
+    'request_level': ((), ()),
+    'input': ((int, int, int, int, DIRECTIONS_ARG), ()),
+    'request_udp': ((), ()),
+    'request_lockstep': ((), ()),
+    'state_hash': ((int, int), ()),
+}
+
+# Terrain and bonus types go out as their index in this table, new types are appended
+TYPE_NAMES = ("wall", "slow_down", "speed_up", "mushroom", "holy_grail", "add_points")
+TYPE_CODES = {name: code for code, name in enumerate(TYPE_NAMES)}
+
+# Lockstep events are sent as their index in this table
+EVENT_NAMES = ("join", "direction", "lost", "leave")
+EVENT_CODES = {name: code for code, name in enumerate(EVENT_NAMES)}
+
+U16 = struct.Struct('<H')
+U32 = struct.Struct('<I')
+DIRECTION = struct.Struct('<IIbb')  # id, input seq, direction
+INPUT_HEADER = struct.Struct('<IIIIB')  # id, UDP token, last applied snapshot, seq of the newest input, input count
+INPUT_DIRECTION = struct.Struct('<bb')
+LOCKSTEP_HEADER = struct.Struct('<III')  # current tick, checkpoint length, count of logged ticks
+TICK_HEADER = struct.Struct('<IH')  # tick, event count
+EVENT = struct.Struct('<BIhh')  # event code, owner, two arguments (a start position or a direction)
+STATE_HASH_BODY = struct.Struct('<II')  # tick, CRC32 of the world after it
+STATE_HEADER = struct.Struct('<IdHHHH')  # seq, elapsed, terrain, food, bonus and snake counts; points_to_complete comes with the level
+DELTA_HEADER = struct.Struct('<IIdHHHHHHH')  # seq, base seq, elapsed, removed and added counts, snake count
+SNAKE_HEADER = struct.Struct('<IBBBbbffBBI')  # id, color, direction, speed, points, lost, body form, owner's last applied input
+FULL_BODY = struct.Struct('<I')  # point count, then the points
+PATH_BODY = struct.Struct('<IfI')  # vertex count, length and point count, then the vertices
+DELTA_BODY = struct.Struct('<III')  # new head points, points dropped from the tail and the point count after them, then the new points
+BODY_POINTS, BODY_PATH, BODY_DELTA = 0, 1, 2
+
+
+def encode_message(data, version=PICKLE_VERSION):
+    if version == PICKLE_VERSION:
+        message = pickle.dumps(data)
+    else:
+        message = encode_binary(data, version)
+    return config.MAGIC_NUMBER + len(message).to_bytes(4, 'big') + message
+
+
+def decode_header(header):
+    # Returns the payload length announced by an 8-byte header
+    if header[:4] != config.MAGIC_NUMBER:
+        raise ValueError("Invalid magic number received.")
+    message_length = int.from_bytes(header[4:HEADER_SIZE], 'big')
+    if message_length <= 0 or message_length > MAX_MESSAGE_SIZE:
+        raise ValueError(f"Invalid message length: {message_length}")
+    return message_length
+
+
+def decode_message(payload, allow_pickle=True, from_client=False):
+    # from_client: the server side, which only takes client messages of the expected shape
+    if payload[0] == BINARY_MARKER:
+        message = decode_binary(payload, from_client)
+    elif not allow_pickle:
+        raise ValueError("Pickled message refused.")
+    else:
+        message = pickle.loads(payload)
+    if from_client:
+        check_client_message(message)
+    return message
+
+
+def is_direction(value):
+    return isinstance(value, (tuple, list)) and len(value) == 2 and all(isinstance(part, int) for part in value)
+
+
+def check_client_message(message):
+    """Raises ValueError unless message is one a client sends, with arguments of the expected types."""
+    if not (isinstance(message, tuple) and message and isinstance(message[0], str) and message[0] in CLIENT_MESSAGE_ARGS):
+        raise ValueError("Not a client message.")
+    required, optional = CLIENT_MESSAGE_ARGS[message[0]]
+    arguments = message[1:]
+    if not len(required) <= len(arguments) <= len(required) + len(optional):
+        raise ValueError(f"Wrong argument count for {message[0]}.")
+    for argument, expected in zip(arguments, required + optional):
+        if expected == DIRECTION_ARG:
+            valid = is_direction(argument)
+        elif expected == DIRECTIONS_ARG:
+            valid = isinstance(argument, list) and all(is_direction(direction) for direction in argument)
+        else:
+            valid = isinstance(argument, expected)
+        if not valid:
+            raise ValueError(f"Invalid argument for {message[0]}: {argument!r}")
+
+
+def pack_block(typecode, values):
+    # Contiguous little-endian run of numbers
+    values = tuple(values)
+    return struct.pack(f'<{len(values)}{typecode}', *values)
+
+
+def pack_points(points):
+    # Float32 x, y pairs; a SnakeBody is read straight from its coordinate buffer
+    if isinstance(points, SnakeBody):
+        return b''.join(struct.pack(f'<{len(block)}f', *block) for block in points.coordinate_blocks())
+    return pack_block('f', chain.from_iterable(points))
+
+
+def unpack_block(typecode, payload, offset, count):
+    block = array(typecode)
+    end = offset + block.itemsize * count
+    if end > len(payload):
+        raise ValueError("Truncated message.")
+    block.frombytes(payload[offset:end])
+    if sys.byteorder == 'big':
+        block.byteswap()
+    return block, end
+
+
+def pairs(block):
+    return list(zip(block[0::2], block[1::2]))
+
+
+def encode_binary(data, version=BINARY_VERSION):
+    try:
+        if isinstance(data, int):
+            return PREFIX.pack(BINARY_MARKER, version, PLAYER_ID) + U32.pack(data)
+        if isinstance(data, tuple) and data[0] == 'hello':
+            # The server's reply carries its level hash
+            return PREFIX.pack(BINARY_MARKER, version, HELLO) + U16.pack(data[1]) + pack_string(data[2] if len(data) > 2 and data[2] else '')
+        if isinstance(data, tuple) and data[0] == 'level':
+            return PREFIX.pack(BINARY_MARKER, version, LEVEL) + pack_string(data[1]) + U32.pack(len(data[2])) + data[2]
+        if isinstance(data, tuple) and data[0] == 'request_level':
+            return PREFIX.pack(BINARY_MARKER, version, REQUEST_LEVEL)
+        if isinstance(data, tuple) and data[0] == 'input':
+            # Datagram from a UDP client: its newest inputs first, each older one seq - 1
+            _, player_id, token, acked, seq, directions = data
+            return (PREFIX.pack(BINARY_MARKER, version, INPUT) + INPUT_HEADER.pack(player_id, token, acked, seq, len(directions))
+                    + b''.join(INPUT_DIRECTION.pack(*direction) for direction in directions))
+        if isinstance(data, tuple) and data[0] == 'request_udp':
+            return PREFIX.pack(BINARY_MARKER, version, REQUEST_UDP)
+        if isinstance(data, tuple) and data[0] == 'udp':
+            return PREFIX.pack(BINARY_MARKER, version, UDP) + U32.pack(data[1])
+        if isinstance(data, tuple) and data[0] == 'request_lockstep':
+            return PREFIX.pack(BINARY_MARKER, version, REQUEST_LOCKSTEP)
+        if isinstance(data, tuple) and data[0] == 'lockstep':
+            # The tick the server is at, its last world checkpoint, then every later tick that had events
+            _, tick, checkpoint, log = data
+            return (PREFIX.pack(BINARY_MARKER, version, LOCKSTEP) + LOCKSTEP_HEADER.pack(tick, len(checkpoint), len(log))
+                    + checkpoint + b''.join(pack_tick(*entry) for entry in log))
+        if isinstance(data, tuple) and data[0] == 'tick':
+            return PREFIX.pack(BINARY_MARKER, version, TICK) + pack_tick(data[1], data[2])
+        if isinstance(data, tuple) and data[0] == 'state_hash':
+            return PREFIX.pack(BINARY_MARKER, version, STATE_HASH) + STATE_HASH_BODY.pack(data[1], data[2])
+        if isinstance(data, tuple) and data[0] in CLIENT_MESSAGES:
+            kind = CLIENT_MESSAGES[data[0]]
+            if kind == UPDATE_DIRECTION:
+                return PREFIX.pack(BINARY_MARKER, version, kind) + DIRECTION.pack(data[1], data[3] if len(data) > 3 else 0, *data[2])
+            if kind == REQUEST_GAME_STATE:
+                return PREFIX.pack(BINARY_MARKER, version, kind)
+            return PREFIX.pack(BINARY_MARKER, version, kind) + U32.pack(data[1])
+        if isinstance(data, dict) and data.get('action') == 'game_over':
+            reason = data['reason'].encode()
+            return PREFIX.pack(BINARY_MARKER, version, GAME_OVER) + bytes([len(reason)]) + reason
+        if isinstance(data, dict) and 'base_seq' in data:
+            return PREFIX.pack(BINARY_MARKER, version, DELTA) + encode_delta(data)
+        if isinstance(data, dict) and 'snakes' in data:
+            return PREFIX.pack(BINARY_MARKER, version, GAME_STATE) + encode_game_state(data)
+    except (struct.error, KeyError, TypeError) as e:
+        raise ValueError(f"Cannot encode message: {e}") from e
+    raise ValueError(f"No binary encoding for {type(data).__name__} message")
+
+
+def pack_string(text):
+    encoded = text.encode()
+    return bytes([len(encoded)]) + encoded
+
+
+def unpack_string(payload, offset):
+    length = payload[offset]
+    return bytes(payload[offset + 1:offset + 1 + length]).decode(), offset + 1 + length
+
+
+def pack_tick(tick, events):
+    return TICK_HEADER.pack(tick, len(events)) + b''.join(EVENT.pack(EVENT_CODES[kind], owner, x, y) for kind, owner, x, y in events)
+
+
+def unpack_tick(payload, offset):
+    tick, count = TICK_HEADER.unpack_from(payload, offset)
+    offset += TICK_HEADER.size
+    events = []
+    for _ in range(count):
+        code, owner, x, y = EVENT.unpack_from(payload, offset)
+        events.append((EVENT_NAMES[code], owner, x, y))
+        offset += EVENT.size
+    return (tick, events), offset
+
+
+def encode_items(items, typed=True):
+    # Terrains, foods or bonuses: a byte per type code, then the positions as int16 pairs
+    types = bytes(TYPE_CODES[item['type']] for item in items) if typed else b''
+    return types + pack_block('h', chain.from_iterable(item['position'] for item in items))
+
+
+def decode_items(payload, offset, count, typed=True):
+    types = None
+    if typed:
+        types = payload[offset:offset + count]
+        offset += count
+    positions, offset = unpack_block('h', payload, offset, 2 * count)
+    if typed:
+        return [{'type': TYPE_NAMES[code], 'position': position} for code, position in zip(types, pairs(positions))], offset
+    return [{'position': position} for position in pairs(positions)], offset
+
+
+def encode_snakes(snakes):
+    parts = []
+    for client_id, snake in snakes.items():
+        form = BODY_PATH if 'path' in snake else BODY_DELTA if 'append' in snake else BODY_POINTS
+        parts.append(SNAKE_HEADER.pack(client_id, *snake['color'], *snake['direction'],
+                                       snake['speed'], snake['points'], snake['lost'], form, snake.get('input_seq', 0)))
+        if form == BODY_PATH:
+            parts.append(PATH_BODY.pack(len(snake['path']), snake['length'], snake['count']))
+            parts.append(pack_points(snake['path']))
+        elif form == BODY_DELTA:
+            parts.append(DELTA_BODY.pack(len(snake['append']), snake['trim'], snake['count']))
+            parts.append(pack_points(snake['append']))
+        else:
+            parts.append(FULL_BODY.pack(len(snake['body'])))
+            parts.append(pack_points(snake['body']))
+    return parts
+
+
+def decode_snakes(payload, offset, count):
+    snakes = {}
+    for _ in range(count):
+        client_id, red, green, blue, dx, dy, speed, points, lost, form, input_seq = SNAKE_HEADER.unpack_from(payload, offset)
+        offset += SNAKE_HEADER.size
+        snake = {'color': (red, green, blue), 'direction': (dx, dy), 'speed': speed, 'points': points, 'lost': bool(lost),
+                 'input_seq': input_seq}
+        if form == BODY_PATH:
+            vertex_count, snake['length'], snake['count'] = PATH_BODY.unpack_from(payload, offset)
+            vertices, offset = unpack_block('f', payload, offset + PATH_BODY.size, 2 * vertex_count)
+            snake['path'] = pairs(vertices)
+        elif form == BODY_DELTA:
+            append_count, snake['trim'], snake['count'] = DELTA_BODY.unpack_from(payload, offset)
+            offset += DELTA_BODY.size
+            appended, offset = unpack_block('f', payload, offset, 2 * append_count)
+            snake['append'] = pairs(appended)
+        else:
+            point_count, = FULL_BODY.unpack_from(payload, offset)
+            points_block, offset = unpack_block('f', payload, offset + FULL_BODY.size, 2 * point_count)
+            snake['body'] = pairs(points_block)
+        snakes[client_id] = snake
+    return snakes, offset
+
+
+def encode_game_state(game_state):
+    terrains, foods, bonuses = game_state['terrains'], game_state['foods'], game_state['bonuses']
+    parts = [STATE_HEADER.pack(game_state['seq'], game_state['elapsed'], len(terrains), len(foods), len(bonuses), len(game_state['snakes']))]
+    parts += [encode_items(terrains), encode_items(foods, typed=False), encode_items(bonuses)]
+    parts += encode_snakes(game_state['snakes'])
+    return b''.join(parts)
+
+
+def encode_delta(delta):
+    terrains, foods, bonuses = delta['terrains'], delta['foods'], delta['bonuses']
+    counts = (len(terrains[0]), len(terrains[1]), len(foods[0]), len(foods[1]),
+              len(bonuses[0]), len(bonuses[1]), len(delta['snakes']))
+    parts = [DELTA_HEADER.pack(delta['seq'], delta['base_seq'], delta['elapsed'], *counts)]
+    for key in ('terrains', 'foods', 'bonuses'):
+        removed, added = delta[key]
+        parts += [encode_items(removed, key != 'foods'), encode_items(added, key != 'foods')]
+    parts += encode_snakes(delta['snakes'])
+    return b''.join(parts)
+
+
+def decode_binary(payload, from_client=False):
+    try:
+        marker, version, kind = PREFIX.unpack_from(payload)
+        if version > BINARY_VERSION:
+            raise ValueError(f"Unsupported protocol version {version}")
+        if from_client and kind not in FROM_CLIENT:
+            raise ValueError(f"Message kind {kind} is not sent by clients")
+        if kind in LOCKSTEP_KINDS and version < LOCKSTEP_MIN_VERSION:
+            raise ValueError(f"Lockstep message in protocol version {version}")
+        offset = PREFIX.size
+        if kind == HELLO:
+            client_version, = U16.unpack_from(payload, offset)
+            level, offset = unpack_string(payload, offset + U16.size)
+            return ('hello', client_version, level or None)
+        if kind == LEVEL:
+            level, offset = unpack_string(payload, offset)
+            length, = U32.unpack_from(payload, offset)
+            offset += U32.size
+            if offset + length > len(payload):
+                raise ValueError("Truncated message.")
+            return ('level', level, bytes(payload[offset:offset + length]))
+        if kind == REQUEST_LEVEL:
+            return ('request_level',)
+        if kind == INPUT:
+            player_id, token, acked, seq, count = INPUT_HEADER.unpack_from(payload, offset)
+            offset += INPUT_HEADER.size
+            directions = [INPUT_DIRECTION.unpack_from(payload, offset + index * INPUT_DIRECTION.size) for index in range(count)]
+            return ('input', player_id, token, acked, seq, directions)
+        if kind == REQUEST_UDP:
+            return ('request_udp',)
+        if kind == UDP:
+            return ('udp', U32.unpack_from(payload, offset)[0])
+        if kind == REQUEST_LOCKSTEP:
+            return ('request_lockstep',)
+        if kind == LOCKSTEP:
+            tick, length, count = LOCKSTEP_HEADER.unpack_from(payload, offset)
+            offset += LOCKSTEP_HEADER.size
+            if offset + length > len(payload):
+                raise ValueError("Truncated message.")
+            checkpoint = bytes(payload[offset:offset + length])
+            offset += length
+            log = []
+            for _ in range(count):
+                entry, offset = unpack_tick(payload, offset)
+                log.append(entry)
+            return ('lockstep', tick, checkpoint, log)
+        if kind == TICK:
+            (tick, events), offset = unpack_tick(payload, offset)
+            return ('tick', tick, events)
+        if kind == STATE_HASH:
+            return ('state_hash', *STATE_HASH_BODY.unpack_from(payload, offset))
+        if kind == PLAYER_ID:
+            return U32.unpack_from(payload, offset)[0]
+        if kind == UPDATE_DIRECTION:
+            player_id, seq, dx, dy = DIRECTION.unpack_from(payload, offset)
+            return ('update_direction', player_id, (dx, dy), seq)
+        if kind == REQUEST_GAME_STATE:
+            return ('request_game_state',)
+        if kind in CLIENT_KINDS:
+            return (CLIENT_KINDS[kind], U32.unpack_from(payload, offset)[0])
+        if kind == GAME_OVER:
+            return {'action': 'game_over', 'reason': unpack_string(payload, offset)[0]}
+        if kind == GAME_STATE:
+            return decode_game_state(payload, offset)
+        if kind == DELTA:
+            return decode_delta(payload, offset)
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed message: {e}") from e
+    raise ValueError(f"Unknown message kind {kind}")
+
+
+def decode_game_state(payload, offset):
+    game_state = {}
+    game_state['seq'], elapsed, terrain_count, food_count, bonus_count, snake_count = STATE_HEADER.unpack_from(payload, offset)
+    offset += STATE_HEADER.size
+
+    game_state['terrains'], offset = decode_items(payload, offset, terrain_count)
+    game_state['foods'], offset = decode_items(payload, offset, food_count, typed=False)
+    game_state['bonuses'], offset = decode_items(payload, offset, bonus_count)
+    game_state['snakes'], offset = decode_snakes(payload, offset, snake_count)
+    game_state['elapsed'] = elapsed
+    return game_state
+
+
+def decode_delta(payload, offset):
+    seq, base_seq, elapsed, *counts, snake_count = DELTA_HEADER.unpack_from(payload, offset)
+    offset += DELTA_HEADER.size
+    delta = {'seq': seq, 'base_seq': base_seq, 'elapsed': elapsed}
+    for index, key in enumerate(('terrains', 'foods', 'bonuses')):
+        typed = key != 'foods'
+        removed, offset = decode_items(payload, offset, counts[2 * index], typed)
+        added, offset = decode_items(payload, offset, counts[2 * index + 1], typed)
+        delta[key] = (removed, added)
+    delta['snakes'], offset = decode_snakes(payload, offset, snake_count)
+    return delta
+
+
+def benchmark(level_number=2, snakes=8, body_length=400, rounds=2000):
+    # Encode and decode a realistic snapshot with pickle and with the binary format, prints time and size
+    import time
+    from .engine import World
+    from .snake import Snake
+    world = World()
+    world.load_level(level_number)
+    for owner in range(snakes):
+        snake = Snake(start_pos=(config.SCREEN_WIDTH // 2, 2 * config.SNAKE_SIZE * (owner + 1)))
+        snake.grow(body_length)
+        world.add_snake(owner, snake)
+    world.spawn_food()
+    world.spawn_bonus()
+    for tick in range(body_length):
+        for snake in world.snakes.values():
+            if tick % 60 == 0:
+                snake.change_direction(config.UP if tick % 120 else config.LEFT)
+            snake.lost = False
+        world.step()
+
+    def game_state(live_body):
+        return {
+            'seq': world.ticks,
+            'terrains': [terrain.get_terrain_data() for terrain in world.terrains],
+            'snakes': {owner: snake.get_snake_data(live_body=live_body) for owner, snake in world.snakes.items()},
+            'foods': [food.get_food_data() for food in world.foods],
+            'bonuses': [bonus.get_bonus_data() for bonus in world.bonuses],
+            'points_to_complete': world.points_to_complete,
+            'elapsed': world.elapsed,
+        }
+
+    # Encoding times include building the snapshot, the binary format reads bodies in place
+    for name, version in (("pickle", PICKLE_VERSION), ("binary", BINARY_VERSION)):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            message = encode_message(game_state(version != PICKLE_VERSION), version)
+        encoded = time.perf_counter() - started
+        payload = message[HEADER_SIZE:]
+        started = time.perf_counter()
+        for _ in range(rounds):
+            decode_message(payload)
+        decoded = time.perf_counter() - started
+        print(f"{name}: {len(message)} bytes, encode {1e6 * encoded / rounds:.1f} us, decode {1e6 * decoded / rounds:.1f} us")
+
+
+if __name__ == "__main__":
+    benchmark()
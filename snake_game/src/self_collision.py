@@ -0,0 +1,78 @@
+import math
+from collections import deque
+from .geometry import square_rect, rects_collide
+from . import config
+
+
+class SelfCollisionIndex:
+    """Per-snake index of the body cells far enough from the head to be hit by it.
+
+    A new head waits in a queue until the head has travelled neck_length past
+    it (measured along the body, not in segments), then moves into a cell grid.
+    Tails leave from whichever side holds them. Checking the head only looks at
+    the grid cells around it, so nothing is copied and the cost does not grow
+    with the length of the snake.
+    """
+
+    def __init__(self, neck_length=config.SELF_COLLISION_NECK_LENGTH, cell_size=config.SPATIAL_HASH_CELL_SIZE):
+        self.neck_length = neck_length
+        self.cell_size = cell_size
+        self.tracks = {}  # owner -> SnakeTrack
+
+    def add_body(self, owner, body, block_size):
+        self.tracks[owner] = SnakeTrack(block_size)
+        for i in range(len(body) - 1, -1, -1):
+            self.add_segment(owner, body.head_seq - i, body[i])
+
+    def remove_owner(self, owner):
+        self.tracks.pop(owner, None)
+
+    def cell_of(self, x, y):
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    def add_segment(self, owner, seq, point):
+        track = self.tracks[owner]
+        x, y = point
+        if track.last is not None:
+            track.arc += math.hypot(x - track.last[0], y - track.last[1])
+        track.last = (x, y)
+        track.neck.append((seq, x, y, track.arc))
+        # Segments the head has moved far enough away from join the searchable cells
+        while track.neck and track.arc - track.neck[0][3] >= self.neck_length:
+            seq, x, y, arc = track.neck.popleft()
+            track.cells.setdefault(self.cell_of(x, y), deque()).append((seq, x, y))
+
+    def remove_segment(self, owner, seq, point):
+        track = self.tracks[owner]
+        if track.neck and track.neck[0][0] == seq:
+            track.neck.popleft()
+            return
+        cell = self.cell_of(point[0], point[1])
+        segments = track.cells[cell]
+        segments.popleft()
+        if not segments:
+            del track.cells[cell]
+
+    def collides(self, owner, head, size):
+        track = self.tracks.get(owner)
+        if track is None or not track.cells:
+            return False
+        head_rect = square_rect(head, size)
+        reach = track.block_size
+        min_x, min_y = self.cell_of(head_rect[0] - reach, head_rect[1] - reach)
+        max_x, max_y = self.cell_of(head_rect[0] + size + reach, head_rect[1] + size + reach)
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                for seq, x, y in track.cells.get((cell_x, cell_y), ()):
+                    if rects_collide(head_rect, square_rect((x, y), track.block_size)):
+                        return True
+        return False
+
+
+class SnakeTrack:
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self.arc = 0.0      # Distance travelled by the head since the body was indexed
+        self.last = None    # Newest point, to measure the next step
+        self.neck = deque()  # (seq, x, y, arc) of segments still too close to the head
+        self.cells = {}      # (cell_x, cell_y) -> deque of (seq, x, y), oldest first
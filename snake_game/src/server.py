@@ -1,17 +1,17 @@
-import json
+import sys
 import random
-import pygame
 import pickle
 import socket
+import select
 import threading
+from contextlib import nullcontext
 from threading import Lock
-from pygame.locals import K_UP, K_DOWN, K_LEFT, K_RIGHT, K_ESCAPE
-from .snake import Snake
-from .bonus import Bonus
-from .terrain import Terrain
-from .highscore import Highscore
-from .food import Food
-from .drawing import draw_game
+from .engine import World
+from .snapshot_delta import SnapshotHistory
+from .session import Session
+from .framing import FrameReader
+from .datagram import open_channel
+from . import protocol
 from . import config
 import time
 import logging
@@ -19,345 +19,305 @@ import logging
 # Configure logging at the beginning of the file
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
-class Server:
-    def __init__(self, ip=config.LOCAL_IP, port=5432):
-        self.clients = {}
+class BaseServer:
+    """Game state, client bookkeeping and message handling shared by Server and AsyncServer.
+
+    Subclasses own the sockets: they drain each session's outbound queue with
+    a writer of their own, provide close_connection(connection) and
+    remove_client(client_id), and call advance() once per simulation tick.
+    Nothing here writes to a socket, so a slow client never holds up the tick.
+    With config.LOCKSTEP every change to the world between ticks goes through
+    record_event(), and clients that ask for lockstep get those events each
+    tick instead of snapshots.
+    """
+
+    def __init__(self):
+        self.clients = {}  # client_id -> Session
         self.client_id_counter = 0
         self.running = True
         self.game_over = False
-        self.width, self.height = config.SCREEN_WIDTH, config.SCREEN_HEIGHT
-        self.panel_height = config.PANEL_HEIGHT
-        self.clock = pygame.time.Clock()
-        self.start_time = pygame.time.get_ticks()
-        self.foods = []
-        self.terrains = []
-        self.bonus_spawn_timer = 0
-        self.grail_spawn_timer = 0
-        self.shroom_spawn_timer = 0 # Time in milliseconds between bonus spawns
-        self.bonus_spawn_interval = config.BONUS_SPAWN_INTERVAL  
+        self.game_state_lock = nullcontext()  # The threaded server swaps in a real lock
+        self.world = World(vectorized_collisions=config.VECTORIZED_COLLISIONS, polyline_collisions=config.POLYLINE_COLLISIONS, seed=random.getrandbits(32))  # Headless rules shared with Game
+        self.started = time.perf_counter()
+        self.lockstep_events = []  # Events since the last tick, sent with the next one
+        self.lockstep_log = []  # (tick, events) for every tick since the checkpoint that had events
+        self.state_hashes = {}  # tick -> world hash, to check the ones lockstep clients report
         self.load_level(config.DEFAULT_LEVEL)
-        self.clients_to_remove = {}
-
-        self.game_state_lock = Lock()
-        self.addr = (ip, port)
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.bind(self.addr)
-        self.server.listen(config.WAIT_LIST_SIZE)
-        self.accept_connections_thread = threading.Thread(target=self.accept_connections)
-        self.accept_connections_thread.start()
-
-        self.ticks = 1
-
-        self.client_locks = {}  # Added dictionary to store locks per client
-        self.client_threads = []  # Initialize a list to keep track of client threads
+        self.lockstep_checkpoint = self.world.checkpoint()  # Clients joining later start from it and replay the log
         self.game_over_processed = False  # **Initialize the game over flag**
 
-    def accept_connections(self):
-        print("Server is listening for connections...")
-        while self.running:
-            try:
-                conn, addr = self.server.accept()
-                print(f"New connection from {addr}")
-                # Handle the new connection (e.g., add the client to the clients list)
-                self.add_client(conn, addr)
-            except:
-                break
-        print("Server stopped listening for connections.")
-
-    def send_data(self, connection, data):
-        message = pickle.dumps(data)
-        message_length = len(message)
-        # Find the client_id based on connection
-        client_id = None
-        for cid, cdata in self.clients.items():
-            if cdata['connection'] == connection:
-                client_id = cid
-                break
-        if client_id is None:
-            print("Attempted to send data to unknown client.")
-            return
+        self.snapshot_cache = None  # (tick, {(protocol version, delta base): encoded game state}), dropped whenever the state changes between ticks
+        self.snapshot_seq = 0  # Numbers each distinct snapshot, clients acknowledge these
+        self.snapshot_history = SnapshotHistory()
+        self.snapshot_hits = 0
+        self.snapshot_misses = 0
+        self.udp = None  # DatagramChannel for snapshots and inputs, opened by subclasses when config.UDP_TRANSPORT is set
 
-        try:
-            with self.client_locks[client_id]:  # Acquiring lock for this client
-                connection.sendall(config.MAGIC_NUMBER)
-                connection.sendall(message_length.to_bytes(4, 'big'))
-                connection.sendall(message)
-        except socket.error as e:
-            print(f"Socket error while sending to client {client_id}: {e}")
-            self.disconnect_client(client_id)
-        except pickle.PickleError as e:
-            print(f"Pickle error while sending to client {client_id}: {e}")
-            self.disconnect_client(client_id)
-
-    def recvall(self, connection, length):
-        data = b''
-        while len(data) < length:
-            more = connection.recv(length - len(data))
-            if not more:
-                raise EOFError('Socket closed before receiving all data')
-            data += more
-        return data
-
-    def recv_data(self, connection):
-        client_id = None
-        for cid, cdata in self.clients.items():
-            if cdata['connection'] == connection:
-                client_id = cid
-                break
-        if client_id is None:
-            print("Attempted to receive data from unknown client.")
-            return None
-
-        try:
-            with self.client_locks[client_id]:  # Acquiring lock for this client
-                received_magic = self.recvall(connection, 4)
-                if received_magic != config.MAGIC_NUMBER:
-                    raise ValueError("Invalid magic number received.")
-
-                message_length = int.from_bytes(self.recvall(connection, 4), 'big')
-                if message_length <= 0 or message_length > 10**6:
-                    raise ValueError(f"Invalid message length: {message_length}")
-                data = self.recvall(connection, message_length)
-                received_data = pickle.loads(data)
-                #print(f"Received data from client {client_id}: {received_data}")
-                return received_data
-        except (pickle.UnpicklingError, ValueError, EOFError, socket.error) as e:
-            print(f"Error receiving data from client {client_id}: {e}")
-            self.disconnect_client(client_id)
-            return None
-
-    def add_client(self, connection, addr):
+    def register_client(self, connection, addr):
         client_id = self.client_id_counter
         start_y = random.randint(2 * config.SNAKE_SIZE, config.SCREEN_HEIGHT - config.SNAKE_SIZE)
         start_x = 2 * config.SNAKE_SIZE
 
-        # Initialize a lock for this client
-        self.client_locks[client_id] = threading.Lock()
-
-        # Add client to self.clients before sending data
-        self.clients[client_id] = {
-            'connection': connection,
-            'address': addr,
-            'snake': Snake(start_pos=(start_x, start_y)),
-            'end_reason': '',
-        }
-        print(f"Client {client_id} connected: {addr}")
-        #print(self.clients)
-
-        # Send client's id after client is added to self.clients
-        self.send_data(connection, client_id)
+        with self.game_state_lock:
+            self.record_event(('join', client_id, start_x, start_y))
+            snake = self.world.snakes[client_id]
+            if config.COMPACT_SNAKE_DATA:
+                snake.enable_path()
+            session = self.clients[client_id] = Session(client_id, connection, addr, snake)
+            self.snapshot_cache = None
         self.client_id_counter += 1
+        print(f"Client {client_id} connected: {addr}")
+        return session
 
-        handle_messages_thread = threading.Thread(target=self.handle_client_messages, args=(client_id,))
-        handle_messages_thread.start()
-        self.client_threads.append(handle_messages_thread)  # **TRACK THE THREAD**
-
-    def disconnect_client(self, client_id):
-        client_data = self.clients[client_id]
-        #self.send_data(client_data['connection'], {'end_reason': 'game_over'})
-        self.clients_to_remove[client_id] = True
-
-    def remove_client(self, client_id):
-        print(f"removing {client_id} client ...")
-        if client_id in self.clients:
-            connection = self.clients[client_id]['connection']
-            connection.close()
-            del self.clients[client_id]
-        if client_id in self.client_locks:
-            del self.client_locks[client_id]
-        print(f"Client {client_id} disconnected")
-
-    def prepare_game_state(self):
+    def unregister_client(self, client_id):
         with self.game_state_lock:
-            game_state = {
-                'terrains': [terrain.get_terrain_data() for terrain in self.terrains],
-                'snakes': {client_id: client_data['snake'].get_snake_data() for client_id, client_data in self.clients.items() if not client_data['snake'].lost},
-                'foods': [food.get_food_data() for food in self.foods],
-                'bonuses': [bonus.get_bonus_data() for bonus in self.bonuses],
-                'points_to_complete': self.points_to_complete,
-                'start_time': self.start_time,
-            }
-            return game_state
-        
-
-    def handle_client_messages(self, client_id):
-        client_data = self.clients[client_id]
-        connection = client_data['connection']
-
-        while self.running and not client_data['snake'].lost:
-            try:
-                message = self.recv_data(connection)
-                if message is None:
-                    break
-                if message[0] == 'update_direction':
-                    new_direction = message[2]
-                    client_data['snake'].direction = new_direction
-                elif message[0] == 'request_game_state':
-                    game_state = self.prepare_game_state()
-                    self.send_data(connection, game_state)
-                elif message[0] == 'disconnecting':
-                    client_data['snake'].lost = True
-            except socket.error as e:
-                print(f"Socket error with client {client_id}: {e}")
-                break
-            except EOFError:
-                print(f"Client {client_id} is disconnecting ...")
-                break
-        
-        print(f"removing {client_id} client ...")
-        # If the loop is broken, remove the client
-        if client_data['snake'].lost:
-            client_data['end_reason'] = 'lost'
-        self.remove_client(client_id)
+            self.record_event(('leave', client_id, 0, 0))
+            self.clients.pop(client_id, None)
+            self.snapshot_cache = None
+
+    def record_event(self, event):
+        # Change the world between ticks; callers hold game_state_lock. Lockstep clients apply the same event before the next tick
+        self.world.apply_event(event)
+        if config.LOCKSTEP:
+            self.lockstep_events.append(event)
+
+    def start_lockstep(self, session):
+        # Queued under the lock so no tick is sent between the log and the session joining the broadcast
+        with self.game_state_lock:
+            message = ('lockstep', self.world.ticks, self.lockstep_checkpoint, self.lockstep_log)
+            self.send_message(session, protocol.encode_message(message, session.version))
+            session.lockstep = True
+
+    def check_state_hash(self, session, tick, state_hash):
+        expected = self.state_hashes.get(tick)
+        if expected is not None and expected != state_hash:
+            session.desyncs += 1
+            logging.warning(f"Client {session.client_id} desynced at tick {tick}")
+
+    def handle_message(self, session, message):
+        # Apply one client message, returns the encoded reply to send back or None
+        session.messages_in += 1
+        if message[0] == 'update_direction':
+            # Queued for the next tick boundary rather than changed while a tick may be running
+            session.queue_input(message[3] if len(message) > 3 else 0, message[2], time.perf_counter())
+        elif message[0] == 'request_game_state':
+            return self.snapshot_for(session)
+        elif message[0] == 'hello':
+            # The client speaks the binary protocol, settle on the newest version both sides know
+            session.version = min(message[1], protocol.BINARY_VERSION)
+            return protocol.encode_message(('hello', session.version, self.world.level_hash), session.version)
+        elif message[0] == 'request_level':
+            # Sent once per session by clients that do not have the level's static data cached
+            return protocol.encode_message(('level', self.world.level_hash, self.world.level_bytes), session.version)
+        elif message[0] == 'request_udp':
+            # A token of 0 tells the client this server has no UDP transport
+            if self.udp is not None and session.version != protocol.PICKLE_VERSION:
+                session.udp_token = random.getrandbits(32) or 1
+            return protocol.encode_message(('udp', session.udp_token), session.version)
+        elif message[0] == 'subscribe':
+            session.subscribed = True
+        elif message[0] == 'request_lockstep':
+            # Servers not running lockstep push snapshots instead, the client takes whichever comes
+            if config.LOCKSTEP and session.version >= protocol.LOCKSTEP_MIN_VERSION:
+                self.start_lockstep(session)
+            else:
+                session.subscribed = True
+        elif message[0] == 'state_hash':
+            self.check_state_hash(session, message[1], message[2])
+        elif message[0] == 'ack':
+            session.acked = message[1]
+        elif message[0] == 'request_keyframe':
+            session.acked = None
+        elif message[0] == 'disconnecting':
+            with self.game_state_lock:
+                self.record_event(('lost', session.client_id, 0, 0))
+            self.snapshot_cache = None
+        return None
 
-    def load_level(self, level_number):
-        level_file = f"snake_game/levels/level_{level_number}.json"
-        with open(level_file, "r") as file:
-            level_data = json.load(file)
-
-        # Load points to complete and possible bonus types
-        self.points_to_complete = level_data["points_to_complete"]
-        self.possible_bonus_types = level_data["possible_bonus_types"]
-
-        # Load terrains
-        self.terrains = []
-        for terrain_data in level_data["terrains"]:
-            terrain = Terrain(terrain_data["position"], terrain_data["type"])
-            self.terrains.append(terrain)
-
-        # Initialize other game elements
-        self.spawn_food()
-        self.bonuses = []
-
-    # (The rest of the methods from game.py included here, with necessary modifications)
-    def spawn_food(self):
+    def read_datagrams(self):
+        # Handle every datagram waiting on the UDP socket, which is non-blocking
         while True:
-            x = random.randint(config.SCREEN_EDGE_SIZE, self.width - config.SCREEN_EDGE_SIZE)
-            y = random.randint(config.SCREEN_EDGE_SIZE, self.height - config.SCREEN_EDGE_SIZE - self.panel_height)
-            food_position = (x, y)
-
-            if not (self.check_collision(food_position, Food.size) or self.check_collision_with_terrain(food_position, Food.size)):
-                break
+            try:
+                message, addr, size = self.udp.recv(from_client=True)
+            except OSError:
+                return
+            if message is not None:
+                self.handle_datagram(message, addr, size)
+
+    def handle_datagram(self, message, addr, size):
+        # A UDP client's inputs, newest first with older ones repeated, and its last applied snapshot
+        if not (isinstance(message, tuple) and message[0] == 'input'):
+            return
+        _, client_id, token, acked, seq, directions = message
+        session = self.clients.get(client_id)
+        if session is None or not session.udp_token or token != session.udp_token:
+            return
+        session.messages_in += 1
+        session.bytes_in += size
+        if session.udp_addr != addr:
+            session.udp_addr = addr
+            session.subscribed = True
+        if acked > (session.acked or 0):
+            session.acked = acked  # Datagrams can arrive out of order, never move back to an older base
+        now = time.perf_counter()
+        for age in range(len(directions) - 1, -1, -1):
+            if seq - age > 0:
+                session.queue_input(seq - age, directions[age], now)
+
+    def send_data(self, session, data):
+        try:
+            message = protocol.encode_message(data, session.version)
+        except (pickle.PickleError, ValueError) as e:
+            print(f"Encoding error while sending: {e}")
+            return
+        self.send_message(session, message)
+
+    def send_message(self, session, message, state=False, flush=True):
+        # Queue an encoded frame for the session's writer; state frames may be dropped for newer ones
+        if not session.outbound.put(message, state, flush):
+            print(f"Client {session.client_id} is not keeping up, disconnecting")
+            session.outbound.close()
+            self.close_connection(session.connection)
+            return
+        session.messages_out += 1
 
-        food = Food(food_position)
-        self.foods.append(food)
+    def accepts_pickle(self, session):
+        # Pickle can run code when loaded, only take it from clients that never said hello, and only if allowed
+        return config.ACCEPT_PICKLE_CLIENTS and session.version == protocol.PICKLE_VERSION
 
-    def spawn_bonus(self):
-        while True:
-            x = random.randint(config.SCREEN_EDGE_SIZE, self.width - config.SCREEN_EDGE_SIZE)
-            y = random.randint(config.SCREEN_EDGE_SIZE, self.height - config.SCREEN_EDGE_SIZE - self.panel_height)
-            bonus_position = (x, y)
-            bonus_type = random.choice(self.possible_bonus_types)
-            bonus_size = config.BONUS_SIZES[bonus_type]
+    def broadcast_game_state(self):
+        # One snapshot per tick, encoded once per protocol version and delta base and written to every subscribed client
+        for session in list(self.clients.values()):
+            if not session.subscribed:
+                continue
+            message = self.snapshot_for(session)
+            if session.udp_addr is not None and len(message) <= config.MAX_DATAGRAM_SIZE:
+                self.udp.send(message, session.udp_addr)
+                session.messages_out += 1
+                session.bytes_out += len(message)
+            else:
+                self.send_message(session, message, state=True, flush=False)
+
+    def broadcast_tick(self):
+        # Log the tick's events and send them to lockstep clients; callers hold game_state_lock
+        events, self.lockstep_events = self.lockstep_events, []
+        tick = self.world.ticks
+        if events:
+            self.lockstep_log.append((tick, events))
+        if tick % config.LOCKSTEP_HASH_INTERVAL == 0:
+            self.state_hashes[tick] = self.world.state_hash()
+            if len(self.state_hashes) > config.LOCKSTEP_HASH_HISTORY:
+                del self.state_hashes[next(iter(self.state_hashes))]
+        if tick % config.LOCKSTEP_CHECKPOINT_INTERVAL == 0:
+            # Every logged event is in the world now, so the join message stays as small as the world
+            self.lockstep_checkpoint = self.world.checkpoint()
+            self.lockstep_log = []
+        messages = {}  # Protocol version -> encoded tick
+        for session in list(self.clients.values()):
+            if session.lockstep:
+                if session.version not in messages:
+                    messages[session.version] = protocol.encode_message(('tick', tick, events), session.version)
+                self.send_message(session, messages[session.version], flush=False)
+
+    def flush_outbound(self):
+        # Hand every writer what the tick queued for it, one write per client
+        for session in list(self.clients.values()):
+            session.outbound.flush()
+
+    def snapshot_for(self, session):
+        # A delta against the client's last acknowledged snapshot, or a keyframe when it has none or one is due
+        base_seq = session.acked
+        if (not config.DELTA_SNAPSHOTS or session.version == protocol.PICKLE_VERSION or base_seq is None
+                or (config.KEYFRAME_INTERVAL and self.snapshot_seq - session.keyframe_seq >= config.KEYFRAME_INTERVAL)):
+            base_seq = None
+        message, sent_base = self.game_state_message(session.version, base_seq)
+        if sent_base is None:
+            session.keyframe_seq = self.snapshot_seq
+        return message
+
+    def live_snakes(self):
+        return {client_id: session.snake for client_id, session in self.clients.items() if not session.snake.lost}
+
+    def drop_lost_subscribers(self):
+        # Subscribers never send requests, so their reader would not notice the loss; closing wakes it
+        for session in list(self.clients.values()):
+            if (session.subscribed or session.lockstep) and session.snake.lost:
+                session.subscribed = False
+                self.close_connection(session.connection)
 
-            if not (self.check_collision(bonus_position, bonus_size) or self.check_collision_with_terrain(bonus_position, bonus_size)):
-                break
+    def prepare_game_state(self):
+        with self.game_state_lock:
+            return self.build_game_state()
+
+    def legacy_start_time(self):
+        # Version 0 clients draw the game time as pygame.time.get_ticks() - start_time. That is the clock of a host
+        # running the server in its own process, as before World; a headless server counts from its own start instead
+        pygame = sys.modules.get('pygame')
+        if pygame is not None and pygame.get_init():
+            now = pygame.time.get_ticks()
+        else:
+            now = (time.perf_counter() - self.started) * 1000
+        return now - self.world.elapsed
+
+    def build_game_state(self, live_bodies=False, static_terrain=True, legacy=False):
+        # Callers hold game_state_lock; live_bodies skips copying bodies that are encoded before the lock is released.
+        # Without static_terrain only terrain that can change is listed, the client has the rest from the level.
+        # legacy adds the start_time key that clients from before the binary protocol read
+        game_state = {
+            'seq': self.snapshot_seq,
+            'terrains': [terrain.get_terrain_data() for terrain in self.world.terrains
+                         if static_terrain or terrain.type in config.DYNAMIC_TERRAIN_TYPES],
+            'snakes': {client_id: snake.get_snake_data(config.COMPACT_SNAKE_DATA, live_bodies) for client_id, snake in self.live_snakes().items()},
+            'foods': [food.get_food_data() for food in self.world.foods],
+            'bonuses': [bonus.get_bonus_data() for bonus in self.world.bonuses],
+            'points_to_complete': self.world.points_to_complete,
+            'elapsed': self.world.elapsed,
+        }
+        if legacy:
+            game_state['start_time'] = self.legacy_start_time()
+        return game_state
 
-        bonus = Bonus(bonus_position, bonus_type)
-        self.bonuses.append(bonus)
+    def game_state_message(self, version=protocol.PICKLE_VERSION, base_seq=None):
+        """The encoded game state of the current tick, built once per protocol version and shared by every client until the next change.
 
-    def grow_mushroom(self):
-        # Find all mushroom terrain
-        mushroom_size = config.TERRAIN_SIZES["mushroom"]
-        mushroom_terrains = [terrain for terrain in self.terrains if terrain.type == "mushroom"]
+        With base_seq it is a delta against that snapshot, unless the snapshot has left the history.
+        Returns the message and the base it was made against, None for a keyframe.
+        """
+        with self.game_state_lock:
+            if self.snapshot_cache is None or self.snapshot_cache[0] != self.world.ticks:
+                self.snapshot_seq += 1
+                self.snapshot_cache = (self.world.ticks, {})
+                self.snapshot_history.record(self.snapshot_seq, self.world, self.live_snakes())
+            messages = self.snapshot_cache[1]
+            if not self.snapshot_history.has(base_seq):
+                base_seq = None
+            key = (version, base_seq)
+            if key in messages:
+                self.snapshot_hits += 1
+                return messages[key], base_seq
+            self.snapshot_misses += 1
+            if base_seq is None:
+                legacy = version == protocol.PICKLE_VERSION
+                data = self.build_game_state(live_bodies=not legacy, static_terrain=legacy, legacy=legacy)
+            else:
+                data = self.snapshot_history.delta(base_seq, self.snapshot_seq, self.world, self.live_snakes(), config.COMPACT_SNAKE_DATA)
+            message = messages[key] = protocol.encode_message(data, version)
+            return message, base_seq
 
-        # If no mushroom terrain, do nothing
-        if not mushroom_terrains:
-            return
+    def log_snapshot_stats(self):
+        total = self.snapshot_hits + self.snapshot_misses
+        if total:
+            logging.info(f"Snapshot cache: {self.snapshot_hits} hits, {self.snapshot_misses} misses "
+                         f"({100 * self.snapshot_hits / total:.1f}% reused)")
 
-        # Choose a random mushroom terrain
-        mushroom = random.choice(mushroom_terrains)
-
-        # Calculate adjacent positions
-        adjacent_positions = [
-            (mushroom.position[0] + mushroom_size, mushroom.position[1]),
-            (mushroom.position[0] - mushroom_size, mushroom.position[1]),
-            (mushroom.position[0], mushroom.position[1] + mushroom_size),
-            (mushroom.position[0], mushroom.position[1] - mushroom_size),
-        ]
-
-        # Filter out positions outside the screen
-        adjacent_positions = [
-            pos for pos in adjacent_positions
-            if (0 <= pos[0] <= self.width) and (0 <= pos[1] <= self.height - self.panel_height)
-            and not self.is_position_occupied_by_mushroom(pos)
-        ]
-
-        # Choose a random adjacent position
-        if not adjacent_positions:
-            return
-        new_mushroom_position = random.choice(adjacent_positions)
-
-        # Check if the new position collides with existing terrain
-        if not self.check_collision_with_terrain(new_mushroom_position, mushroom_size):
-            # Create a new mushroom terrain at the chosen position
-            new_mushroom = Terrain(new_mushroom_position, "mushroom")
-            self.terrains.append(new_mushroom)
-
-    def move_grail(self):
-        x = random.randint(config.SCREEN_EDGE_SIZE, self.width - config.SCREEN_EDGE_SIZE)
-        y = random.randint(config.SCREEN_EDGE_SIZE, self.height - config.SCREEN_EDGE_SIZE - self.panel_height)
-        grail_position = (x, y)
-        for terrain in self.terrains:
-            if terrain.type == "holy_grail":
-                terrain.position = grail_position
-
-    def is_position_occupied_by_mushroom(self, position):
-        for terrain in self.terrains:
-            if terrain.type == "mushroom" and terrain.position == position:
-                return True
-        return False
-
-    def check_collision(self, obj_position, obj_size, increment=0, self_id=-1):
-        collisions = {}
-        obj_rect = pygame.Rect(obj_position[0] - obj_size // 2, obj_position[1] - obj_size // 2, obj_size, obj_size)
-        for client_id, client_data in self.clients.items():
-            if client_id == self_id:
-                continue
-            snake = client_data['snake']
-            for segment in snake.body[increment:]:
-                segment_rect = pygame.Rect(segment[0] - snake.block_size // 2, segment[1] - snake.block_size // 2, snake.block_size, snake.block_size)
-                if obj_rect.colliderect(segment_rect):
-                    collisions[client_id] = True
-
-        return collisions
-    
-    def check_collision_with_terrain(self, obj_position, obj_size):
-        obj_rect = pygame.Rect(obj_position[0] - obj_size // 2, obj_position[1] - obj_size // 2, obj_size, obj_size)
-
-        for terrain in self.terrains:
-            terrain_rect = pygame.Rect(terrain.position[0] - terrain.size // 2, terrain.position[1] - terrain.size // 2, terrain.size, terrain.size)
-            if obj_rect.colliderect(terrain_rect) and terrain.type == "wall":
-                return True
-
-        return False
-
-    def check_snake_head_collisions(self):
-        collisions = {}
-        for client_id, client_data in self.clients.items():
-            head_snake = client_data['snake']
-            head_position = head_snake.body[0]
-            head_size = head_snake.block_size
-
-            collided = self.check_collision(head_position, head_size, self_id=client_id)# or self.check_edge_collision(head_position, head_size) TODO
-            if collided:
-                collisions[client_id] = True
-        return collisions
-    # ...
-    def check_edge_collision(self, obj_position, obj_size):  #TODO, ACTS INSANE
-        pos_x, pos_y = obj_position
-        screen_width, screen_height = config.SCREEN_WIDTH, config.SCREEN_HEIGHT
-
-        # Check if the obj reaches the edge of the screen
-        if pos_x < 0 or pos_x >= screen_width or pos_y < 0 or pos_y >= screen_height - self.panel_height:
-            print("Wall got hit")
-            return True
-        return False
+    def load_level(self, level_number):
+        self.world.load_level(level_number)
+        self.world.spawn_food()
 
     def check_end_conditions(self):
         # Check if a player has reached the points limit
-        for client_id, client_data in self.clients.items():
-            if client_data['snake'].points >= self.points_to_complete:
+        for client_id, session in self.clients.items():
+            if session.snake.points >= self.world.points_to_complete:
                 return {'end_reason': 'win', 'winner_id': client_id}
 
         # Check if all players have lost
@@ -376,11 +336,11 @@ class Server:
             if client_id is not None:
                 if client_id in self.clients:
                     logging.debug(f"Sending game_over to client {client_id} with reason '{reason}'")
-                    self.send_data(self.clients[client_id]['connection'], {'action': 'game_over', 'reason': reason})
+                    self.send_data(self.clients[client_id], {'action': 'game_over', 'reason': reason})
             else:
-                for cid, cdata in self.clients.items():
+                for cid, session in list(self.clients.items()):
                     logging.debug(f"Broadcasting game_over to client {cid} with reason '{reason}'")
-                    self.send_data(cdata['connection'], {'action': 'game_over', 'reason': reason})
+                    self.send_data(session, {'action': 'game_over', 'reason': reason})
         except Exception as e:
             logging.error(f"Unexpected error while sending game over: {e}")
             # Optionally, log the error or take additional measures
@@ -396,123 +356,230 @@ class Server:
 
         with self.game_state_lock:
             # Check if the host has lost
-            if 0 in self.clients and self.clients[0]['snake'].lost:
+            if 0 in self.clients and self.clients[0].snake.lost:
                 print("Host has lost the game.")
                 self.send_game_over(reason="host_lost")
             else:
                 # Notify individual guests who have lost
-                for client_id, client_data in self.clients.items():
-                    if client_id != 0 and client_data['snake'].lost:
+                for client_id, session in self.clients.items():
+                    if client_id != 0 and session.snake.lost:
                         print(f"Guest client {client_id} has lost the game.")
                         self.send_game_over(client_id=client_id, reason="you_lost")
-        
-        # **Ensure all game_over messages are sent before shutdown**
-        time.sleep(2)  # **Increased delay to 2 seconds**
 
-        self.running = False  # **Set running to False after sending messages**
-
-    def update(self):
+    def advance(self):
+        """Run one simulation tick. Returns True when the game has just ended and clients were notified."""
         with self.game_state_lock:
-            for client_id, client_data in self.clients.items():
-                snake = client_data["snake"]
-                snake.update()
-
-            for food in self.foods:
-                food_collisions = self.check_collision(food.position, food.size)
-                if food_collisions:
-                    first_key = next(iter(food_collisions))  # host advantage hehe
-                    self.clients[first_key]['snake'].grow(config.SNAKE_GROWTH_RATE)
-                    self.clients[first_key]['snake'].points += 1
-                    self.foods.remove(food)
-                    self.spawn_food()
-
-            # Check if the snake has collected a bonus, apply the bonus effect and remove it from the list
-            for bonus in self.bonuses:
-                bonus_collision = self.check_collision(bonus.position, bonus.size)
-                if bonus_collision:
-                    first_key = next(iter(bonus_collision))  # host advantage fr
-                    if bonus.type == "speed_up":
-                        self.clients[first_key]['snake'].speed_up()
-                    elif bonus.type == "add_points":
-                        self.clients[first_key]['snake'].points += config.BONUS_POINTS
-                    elif bonus.type == "slow_down":
-                        self.clients[first_key]['snake'].slow_down()  #PAUSED HERE
-                    self.bonuses.remove(bonus)
-
-            # Check if the snake is on a terrain tile and apply the terrain effect
-            for terrain in self.terrains:
-                terrain_collision = self.check_collision(terrain.position, terrain.size)
-                for collision_id in terrain_collision:
-                    curr_snake = self.clients[collision_id]['snake']
-                    if terrain.type == "slow_down":
-                        curr_snake.slow_down(config.TERRAIN_SLOW_RATE)
-                    
-                    if terrain.type == "speed_up":
-                        curr_snake.speed_up(config.TERRAIN_SPEEDUP_RATE)
-                    
-                    if terrain.type == "wall":
-                        curr_snake.lost = True
-                    
-                    if terrain.type == "mushroom":
-                        curr_snake.trip()
-                    
-                    if terrain.type == "holy_grail":
-                        curr_snake.points += config.HOLY_GRAIL_ADD
-
-            current_time = pygame.time.get_ticks() - self.start_time
-            if current_time - self.grail_spawn_timer > config.GRAIL_CHANGE_TIME:
-                self.move_grail()
-                self.grail_spawn_timer = current_time
-            
-            if current_time - self.shroom_spawn_timer > config.MUSHROOM_GROW_TIME:
-                self.grow_mushroom()
-                self.shroom_spawn_timer = current_time
-
-            # Spawn a bonus after a certain time
-            if current_time - self.bonus_spawn_timer > self.bonus_spawn_interval:
-                self.spawn_bonus()
-                self.bonus_spawn_timer = current_time
-
-            collisions = self.check_snake_head_collisions()
-            for client_id, client_lost in collisions.items():
-                print (f"Player {client_id} is smashed")
-                self.clients[client_id]['snake'].lost = client_lost
-            if 0 in self.clients and self.clients[0]['snake'].lost == True:
+            now = time.perf_counter()
+            for session in self.clients.values():
+                direction = tuple(session.snake.direction)
+                session.apply_input(now)
+                if config.LOCKSTEP and tuple(session.snake.direction) != direction:
+                    self.lockstep_events.append(('direction', session.client_id, *session.snake.direction))
+            for client_id in self.world.step():
+                print(f"Player {client_id} is smashed")
+            if config.LOCKSTEP:
+                self.broadcast_tick()
+            if 0 in self.clients and self.clients[0].snake.lost == True:
                 print("host lost")
                 self.running = False
-        
+
             # After updating game state, check for end conditions
             end_conditions = self.check_end_conditions()
-            if end_conditions and not self.game_over_processed:
-                if end_conditions['end_reason'] == 'win':
-                    winner_id = end_conditions['winner_id']
-                    print(f"Client {winner_id} has won the game!")
-                    self.send_game_over(reason="win")
-                self.handle_game_over()
+            ended = bool(end_conditions) and not self.game_over_processed
+            if ended and end_conditions['end_reason'] == 'win':
+                winner_id = end_conditions['winner_id']
+                print(f"Client {winner_id} has won the game!")
+                self.send_game_over(reason="win")
+
+        # Outside the lock, handle_game_over and prepare_game_state take it again
+        if ended:
+            self.handle_game_over()
+        else:
+            self.drop_lost_subscribers()
+            self.broadcast_game_state()
+        self.flush_outbound()
+        return ended
+
+
+class Server(BaseServer):
+    def __init__(self, ip=config.LOCAL_IP, port=config.SERVER_PORT):
+        super().__init__()
+
+        self.game_state_lock = Lock()
+        self.addr = (ip, port)
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Restart without waiting out TIME_WAIT, like asyncio does
+        self.server.bind(self.addr)
+        self.server.listen(config.WAIT_LIST_SIZE)
+        self.accept_connections_thread = threading.Thread(target=self.accept_connections)
+        self.accept_connections_thread.start()
+        self.datagram_thread = None
+        if config.UDP_TRANSPORT:
+            self.udp = open_channel(bind=self.server.getsockname())  # Same port number as TCP
+            self.udp.sock.setblocking(False)
+            self.datagram_thread = threading.Thread(target=self.receive_datagrams)
+            self.datagram_thread.start()
+
+        self.ticks = 1
+
+    def accept_connections(self):
+        print("Server is listening for connections...")
+        while self.running:
+            try:
+                conn, addr = self.server.accept()
+                print(f"New connection from {addr}")
+                if config.TCP_NODELAY:
+                    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                # Handle the new connection (e.g., add the client to the clients list)
+                self.add_client(conn, addr)
+            except:
+                break
+        print("Server stopped listening for connections.")
+
+    def receive_datagrams(self):
+        while self.running:
+            readable, _, _ = select.select([self.udp.sock], [], [], 0.2)
+            if readable:
+                self.read_datagrams()
+
+    def write_client_messages(self, session):
+        # The session's writer thread: the only one sending on its socket, it may block without holding anyone up
+        while True:
+            data = session.outbound.wait()
+            if not data:
+                break
+            try:
+                session.connection.sendall(data)
+            except socket.error as e:
+                if not session.outbound.closed:
+                    print(f"Socket error while sending to client {session.client_id}: {e}")
+                    self.close_connection(session.connection)
+                break
+            session.bytes_out += len(data)
+
+    def close_connection(self, connection):
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def recv_data(self, session):
+        try:
+            # Only the session's reader thread reads, writers never wait for it
+            payload = session.frames.read_frame()
+            session.bytes_in += protocol.HEADER_SIZE + len(payload)
+            received_data = protocol.decode_message(payload, self.accepts_pickle(session), from_client=True)
+            #print(f"Received data from client {session.client_id}: {received_data}")
+            return received_data
+        except (pickle.UnpicklingError, ValueError, EOFError, socket.error) as e:
+            print(f"Error receiving data from client {session.client_id}: {e}")
+            return None
+
+    def add_client(self, connection, addr):
+        # Add client to self.clients before sending data
+        session = self.register_client(connection, addr)
+        session.frames = FrameReader(connection)
+        session.writer = threading.Thread(target=self.write_client_messages, args=(session,))
+        session.writer.start()
+
+        # Send client's id after client is added to self.clients
+        self.send_data(session, session.client_id)
+
+        session.reader = threading.Thread(target=self.handle_client_messages, args=(session,))
+        session.reader.start()
+
+    def remove_client(self, client_id):
+        print(f"removing {client_id} client ...")
+        session = self.clients.get(client_id)
+        if session is not None:
+            session.outbound.close()
+            if session.writer is not None and session.writer is not threading.current_thread():
+                session.writer.join(config.OUTBOUND_FLUSH_TIMEOUT)  # Let queued frames such as game_over go out first
+            self.close_connection(session.connection)  # Wakes a writer still blocked on a stuck peer
+            session.connection.close()
+            self.unregister_client(client_id)
+            logging.info(f"Client {client_id}: {session.stats()}")
+        print(f"Client {client_id} disconnected")
+
+    def handle_client_messages(self, session):
+        client_id = session.client_id
+        try:
+            while self.running and not session.snake.lost:
+                try:
+                    message = self.recv_data(session)
+                    if message is None:
+                        break
+                    reply = self.handle_message(session, message)
+                    if reply is not None:
+                        self.send_message(session, reply)
+                except socket.error as e:
+                    print(f"Socket error with client {client_id}: {e}")
+                    break
+                except EOFError:
+                    print(f"Client {client_id} is disconnecting ...")
+                    break
+        finally:
+            # However the loop ended, remove the client
+            print(f"removing {client_id} client ...")
+            if session.snake.lost:
+                session.end_reason = 'lost'
+            self.remove_client(client_id)
+
+    def update(self):
+        if self.advance():
+            # **Ensure all game_over messages are sent before shutdown**
+            time.sleep(2)  # **Increased delay to 2 seconds**
+
+            self.running = False  # **Set running to False after sending messages**
 
     def run(self):
+        # Fixed-rate tick loop, sleeping away whatever is left of each tick
+        tick_seconds = 1 / config.SIMULATION_TICK_RATE
+        next_tick = time.perf_counter()
         while self.running:
             self.update()
-            self.clock.tick(config.CLOCK_TICK)
+            next_tick += tick_seconds
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.perf_counter()  # Running behind, do not try to catch up in a burst
         self.shutdown()
-
     def shutdown(self):
         """
         Gracefully shuts down the server by closing all client connections and joining threads.
         """
         self.running = False
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)  # close() alone does not wake a thread blocked in accept()
+        except socket.error:
+            pass
         self.server.close()
+        self.log_snapshot_stats()
         
         # Close all client connections
-        for client_data in self.clients.values():
+        sessions = list(self.clients.values())
+        for session in sessions:
+            session.outbound.close()
             try:
-                client_data['connection'].shutdown(socket.SHUT_RDWR)
-                client_data['connection'].close()
+                session.connection.shutdown(socket.SHUT_RDWR)
+                session.connection.close()
             except socket.error:
                 pass  # Ignore errors during shutdown
 
         # **JOIN ALL CLIENT THREADS TO ENSURE THEY HAVE FINISHED**
-        for thread in self.client_threads:
-            thread.join()
+        for session in sessions:
+            for thread in (session.reader, session.writer):
+                if thread is not None:
+                    thread.join()
+
+        self.accept_connections_thread.join()
+        if self.datagram_thread is not None:
+            self.datagram_thread.join()
+            self.udp.close()
+
 
-        self.accept_connections_thread.join()
\ No newline at end of file
+if __name__ == "__main__":
+    # Dedicated headless server: python -m snake_game.src.server [ip]
+    server = Server(sys.argv[1] if len(sys.argv) > 1 else config.LOCAL_IP)
+    server.run()
@@ -0,0 +1,74 @@
+from collections import deque
+from .outbound import OutboundQueue
+from . import config
+from . import protocol
+
+
+class Session:
+    """Everything the server keeps about one connected player.
+
+    Servers look sessions up by client id and hand them to every send and
+    receive path, so per-message work does not depend on how many players
+    are connected.
+    """
+
+    def __init__(self, client_id, connection, address, snake):
+        self.client_id = client_id
+        self.connection = connection  # A socket for the threaded server, a StreamWriter for the asyncio one
+        self.address = address
+        self.snake = snake
+        self.end_reason = ''
+        self.subscribed = False  # Pushed a snapshot every tick instead of asking for it
+        self.version = protocol.PICKLE_VERSION  # Raised by the client's hello
+        self.acked = None  # Last snapshot the client applied, deltas are made against it
+        self.keyframe_seq = 0
+        self.lockstep = False  # Sent each tick's events instead of snapshots, runs its own copy of the world
+        self.desyncs = 0  # World hashes reported by a lockstep client that differed from the server's
+        self.udp_token = 0  # Handed out over TCP, proves datagrams come from this client
+        self.udp_addr = None  # Where snapshots go as datagrams once the client registered
+        self.input_seq = 0  # Newest input queued, repeated older ones are skipped
+        self.inputs = deque(maxlen=config.INPUT_QUEUE_SIZE)  # (seq, direction, arrival time) waiting for a tick boundary
+        self.outbound = OutboundQueue()  # Frames for the client's writer
+        self.frames = None  # FrameReader over the socket, the asyncio server reads through its StreamReader instead
+        self.reader = None  # Thread or task reading the connection
+        self.writer = None  # Thread or task draining outbound
+
+        self.messages_in = 0
+        self.bytes_in = 0
+        self.messages_out = 0
+        self.bytes_out = 0
+        self.inputs_applied = 0
+        self.input_latency = 0.0  # Seconds from arrival to the tick that applied an input, summed
+        self.max_input_latency = 0.0
+
+    def queue_input(self, seq, direction, now):
+        # Inputs are applied in sequence order at tick boundaries, seq 0 means the client does not number them
+        if seq == 0:
+            seq = self.input_seq + 1
+        elif seq <= self.input_seq:
+            return
+        self.input_seq = seq
+        self.inputs.append((seq, direction, now))
+
+    def apply_input(self, now):
+        # One turn per tick, so two presses between ticks both count; inputs that change nothing are used up on the way
+        while self.inputs:
+            seq, direction, arrived = self.inputs.popleft()
+            self.snake.input_seq = seq  # Snapshots tell the client every input up to this one is in
+            latency = now - arrived
+            self.inputs_applied += 1
+            self.input_latency += latency
+            self.max_input_latency = max(self.max_input_latency, latency)
+            if tuple(direction) != tuple(self.snake.direction):
+                self.snake.direction = direction
+                return
+
+    def stats(self):
+        text = (f"{self.messages_in} messages ({self.bytes_in} bytes) in, "
+                f"{self.messages_out} messages ({self.bytes_out} bytes) out")
+        if self.inputs_applied:
+            text += (f", {self.inputs_applied} inputs applied after {1000 * self.input_latency / self.inputs_applied:.1f} ms "
+                     f"on average ({1000 * self.max_input_latency:.1f} ms at most)")
+        if self.desyncs:
+            text += f", {self.desyncs} desyncs"
+        return text
@@ -1,35 +1,86 @@
-import pygame
 import random
-from .drawing import draw_snake
+from .snake_body import SnakeBody
+from .polyline import PolylineBody
 from . import config
 
 class Snake:
     def __init__(self, color = config.GREEN, start_pos = config.START_POS, block_size = config.SNAKE_SIZE, start_speed = config.START_SPEED):
         self.color = color
         self.block_size = block_size
+        self.indexes = []           #(index, owner) pairs kept in sync with the body
+        self.path = None            #PolylineBody kept alongside the points once enable_path() is called
+        self.point_count = None     #Number of body points, set for snakes received in compact form
         self.body = [start_pos]
         self.direction = config.LEFT
         self.speed = start_speed
         self.points = 0
         self.lost = False
         self.growth = 0             #How many tail blocks to grow
+        self.moved = False          #Whether the last update advanced the body
+        self.last_tail = None       #Tail point dropped by the last update, for interpolation
+        self.input_seq = 0          #Sequence number of the owner's last input applied, clients drop predicted inputs up to it
+
+    @property
+    def body(self):
+        return self._body
+
+    @body.setter
+    def body(self, points):
+        # Accept plain lists (level data, network snapshots) and keep them in a ring buffer
+        self._body = points if isinstance(points, SnakeBody) else SnakeBody(points)
+        if self.path is not None and self.point_count is None:
+            self.path = PolylineBody.from_points(self._body)
+        for index, owner in self.indexes:
+            index.remove_owner(owner)
+            index.add_body(owner, self._body, self.block_size)
+
+    def attach(self, index, owner):
+        # Register a collision index that follows every head push and tail pop of this snake
+        self.indexes.append((index, owner))
+        index.add_body(owner, self.body, self.block_size)
+
+    def detach(self, index):
+        for attached, owner in self.indexes:
+            if attached is index:
+                index.remove_owner(owner)
+        self.indexes = [(attached, owner) for attached, owner in self.indexes if attached is not index]
+
+    def enable_path(self):
+        # Maintain the turn-point form of the body from now on, for compact snapshots
+        self.path = PolylineBody.from_points(self.body)
+
+    def body_length(self):
+        return self.point_count if self.point_count is not None else len(self.body)
 
     def change_direction(self, new_direction):
         if self.direction[0] * new_direction[0] + self.direction[1] * new_direction[1] == 0:
             self.direction = new_direction
 
     def update(self):
+        self.moved = False
+        self.last_tail = None
         if self.direction == (0, 0):
             return
 
         head_x, head_y = self.body[0]
         new_head = (head_x + self.direction[0] * self.speed / config.HEAD_SPEED_PARAMETER, head_y + self.direction[1] * self.speed / config.HEAD_SPEED_PARAMETER)
-        self.body.insert(0, new_head)
+        self.body.push_head(new_head)
+        for index, owner in self.indexes:
+            index.add_segment(owner, self.body.head_seq, new_head)
+        if self.path is not None:
+            self.path.advance(new_head)
         self.speed += config.PASSIVE_SPEED_INCREMENT
         if self.growth > 0:
             self.growth -= 1
         else:
-            self.body.pop()
+            tail_seq = self.body.head_seq - len(self.body) + 1
+            tail = self.body.pop_tail()
+            for index, owner in self.indexes:
+                index.remove_segment(owner, tail_seq, tail)
+            if self.path is not None and self.body:
+                self.path.trim(self.body[-1])
+            self.last_tail = tail
+        self.moved = True
 
     def grow(self, growth=1):
         self.growth += growth
@@ -42,31 +93,67 @@ class Snake:
         # Decrease the snake's speed by a factor of choice
         self.speed *= slow_rate
 
-    def trip(self):
-        self.color = config.COLOR_OPTIONS[random.randint(0, 6)]
+    def trip(self, rng=random):
+        self.color = config.COLOR_OPTIONS[rng.randint(0, 6)]
 
-    def draw(self, screen):
-        draw_snake(screen, self.body, self.block_size, self.color)
+    def interpolated_body(self, alpha):
+        # Body between the previous update (alpha 0) and the current one (alpha 1).
+        # After one step segment i+1 sits where segment i was, so each segment slides from its successor.
+        length = len(self.body)
+        for i, (x, y) in enumerate(self.body):
+            if i + 1 < length:
+                prev_x, prev_y = self.body[i + 1]
+            elif self.last_tail is not None:
+                prev_x, prev_y = self.last_tail
+            else:
+                prev_x, prev_y = x, y
+            yield (prev_x + (x - prev_x) * alpha, prev_y + (y - prev_y) * alpha)
+
+    def draw(self, screen, alpha=1.0):
+        from .drawing import draw_snake  # Imported here so the simulation runs without pygame
+        if self.point_count is not None:
+            from .drawing import draw_snake_path
+            draw_snake_path(screen, self.path.vertices, self.block_size, self.color)
+            return
+        body = self.body if alpha >= 1 or not self.moved else self.interpolated_body(alpha)
+        draw_snake(screen, body, self.block_size, self.color)
 
     def reset(self, start_pos = config.START_POS):
         self.body = [start_pos]
         self.direction = config.LEFT
         self.growth = 0
+        self.moved = False
+        self.last_tail = None
 
-    def get_snake_data(self):
-        return {
+    def get_snake_data(self, compact=False, live_body=False):
+        # live_body hands out the SnakeBody itself instead of a copy, for callers that encode it right away
+        data = {
             'color': self.color,
-            'body': self.body,
             'direction': self.direction,
             'speed': self.speed,
             'points': self.points,
             'lost': self.lost,
+            'input_seq': self.input_seq,
         }
-    
+        if compact:
+            # Head, turn points and tail instead of one point per tick
+            path = self.path if self.path is not None else PolylineBody.from_points(self.body)
+            data['path'] = list(path.vertices)
+            data['length'] = path.length
+            data['count'] = len(self.body)
+        else:
+            data['body'] = self.body if live_body else self.body.tolist()
+        return data
+
     @classmethod
     def from_data(cls, data):
         snake = cls(color=data['color'], block_size=config.SNAKE_SIZE, start_speed=data['speed'])
-        snake.body = data['body']
+        if 'path' in data:
+            snake.point_count = data['count']
+            snake.path = PolylineBody(data['path'], data['length'])
+            snake.body = data['path']
+        else:
+            snake.body = data['body']
         snake.direction = data['direction']
         snake.points = data['points']
         snake.lost = data['lost']
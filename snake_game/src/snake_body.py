@@ -0,0 +1,103 @@
+from array import array
+from . import config
+
+
+class SnakeBody:
+    """Circular buffer of (x, y) points, head first.
+
+    Pushing a new head and popping the tail are O(1); the coordinates live in a
+    single preallocated float array that doubles when it runs out of room.
+    Indexing, slicing, iteration and len() behave like the list it replaces.
+    """
+
+    def __init__(self, points=(), capacity=config.SNAKE_BODY_CAPACITY):
+        points = list(points)
+        self._capacity = max(capacity, len(points), 1)
+        self._coords = array('d', bytes(16 * self._capacity))
+        self._head = 0
+        self._length = 0
+        self._pushed = 0
+        for point in reversed(points):
+            self.push_head(point)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        coords = self._coords
+        capacity = self._capacity
+        index = self._head
+        for _ in range(self._length):
+            yield (coords[2 * index], coords[2 * index + 1])
+            index += 1
+            if index == capacity:
+                index = 0
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(self._length))]
+        if item < 0:
+            item += self._length
+        if not 0 <= item < self._length:
+            raise IndexError('snake body index out of range')
+        index = (self._head + item) % self._capacity
+        return (self._coords[2 * index], self._coords[2 * index + 1])
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == tuple(b) for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return f"SnakeBody({list(self)!r})"
+
+    def coordinate_blocks(self):
+        # Head-first flat x, y runs backed by the buffer itself (two when the ring wraps around)
+        view = memoryview(self._coords)
+        end = self._head + self._length
+        if end <= self._capacity:
+            return [view[2 * self._head:2 * end]]
+        return [view[2 * self._head:], view[:2 * (end - self._capacity)]]
+
+    def tolist(self):
+        # Same as list(self), built from the buffer runs instead of the Python-level iterator
+        points = []
+        for block in self.coordinate_blocks():
+            points.extend(zip(block[0::2], block[1::2]))
+        return points
+
+    @property
+    def head_seq(self):
+        # Sequence number of the current head; segment i has sequence number head_seq - i
+        return self._pushed - 1
+
+    def push_head(self, point):
+        if self._length == self._capacity:
+            self._grow()
+        self._head = (self._head - 1) % self._capacity
+        self._coords[2 * self._head] = point[0]
+        self._coords[2 * self._head + 1] = point[1]
+        self._length += 1
+        self._pushed += 1
+
+    def pop_tail(self):
+        if self._length == 0:
+            raise IndexError('pop from empty snake body')
+        self._length -= 1
+        index = (self._head + self._length) % self._capacity
+        return (self._coords[2 * index], self._coords[2 * index + 1])
+
+    def clear(self):
+        self._head = 0
+        self._length = 0
+
+    def _grow(self):
+        # Unwrap into a buffer twice as large so the head starts at index 0 again
+        points = list(self)
+        self._capacity *= 2
+        self._coords = array('d', bytes(16 * self._capacity))
+        self._head = 0
+        for i, (x, y) in enumerate(points):
+            self._coords[2 * i] = x
+            self._coords[2 * i + 1] = y
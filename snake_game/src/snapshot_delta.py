@@ -0,0 +1,152 @@
+from collections import Counter, OrderedDict
+from . import config
+
+
+class SnapshotHistory:
+    """What recent snapshots contained, by sequence number.
+
+    A client acknowledges the last snapshot it applied, and the server then
+    sends only what changed since that one. Terrains, foods and bonuses are
+    kept as multisets of (type, position). For snakes, the body buffer, its
+    head sequence number and its length are enough to tell which points were
+    pushed at the head and how many left the tail. That stream of head points
+    and tail trims is all a snake costs after its first keyframe; the point
+    count that goes with it lets the client notice a body it rebuilt wrong
+    and ask for a keyframe.
+    """
+
+    def __init__(self, size=config.DELTA_HISTORY):
+        self.size = size
+        self.records = OrderedDict()
+
+    def has(self, seq):
+        return seq in self.records
+
+    def record(self, seq, world, snakes):
+        self.records[seq] = {
+            'terrains': Counter((terrain.type, tuple(terrain.position)) for terrain in world.terrains),
+            'foods': Counter((None, tuple(food.position)) for food in world.foods),
+            'bonuses': Counter((bonus.type, tuple(bonus.position)) for bonus in world.bonuses),
+            'snakes': {client_id: (snake.body, snake.body.head_seq, len(snake.body)) for client_id, snake in snakes.items()},
+        }
+        while len(self.records) > self.size:
+            self.records.popitem(last=False)
+
+    def delta(self, base_seq, seq, world, snakes, compact=False):
+        """Changes from snapshot base_seq to snapshot seq, which must be the current state. None if either is unknown."""
+        base, current = self.records.get(base_seq), self.records.get(seq)
+        if base is None or current is None:
+            return None
+
+        delta = {'seq': seq, 'base_seq': base_seq, 'elapsed': world.elapsed, 'points_to_complete': world.points_to_complete}
+        for key in ('terrains', 'foods', 'bonuses'):
+            delta[key] = (expand(base[key] - current[key]), expand(current[key] - base[key]))
+
+        # Every current snake is listed, a snake missing from the delta is gone
+        delta['snakes'] = {}
+        for client_id, snake in snakes.items():
+            previous = base['snakes'].get(client_id)
+            body = snake.body
+            appended = body.head_seq - previous[1] if previous is not None else -1
+            if previous is None or previous[0] is not body or compact or not 0 <= appended <= len(body):
+                # New snake, replaced body or path form: send it whole
+                delta['snakes'][client_id] = snake.get_snake_data(compact, live_body=True)
+                continue
+            delta['snakes'][client_id] = {
+                'color': snake.color,
+                'direction': snake.direction,
+                'speed': snake.speed,
+                'points': snake.points,
+                'lost': snake.lost,
+                'input_seq': snake.input_seq,
+                'append': body[:appended],
+                'trim': previous[2] + appended - len(body),
+                'count': len(body),
+            }
+        return delta
+
+
+def expand(counter):
+    return [{'type': item_type, 'position': position} if item_type is not None else {'position': position}
+            for (item_type, position), count in counter.items() for _ in range(count)]
+
+
+def patch(items, removed, added):
+    remaining = Counter((item.get('type'), tuple(item['position'])) for item in removed)
+    kept = []
+    for item in items:
+        key = (item.get('type'), tuple(item['position']))
+        if remaining[key] > 0:
+            remaining[key] -= 1
+        else:
+            kept.append(item)
+    return kept + added
+
+
+def apply_delta(base_state, delta):
+    """The full game state a delta describes, rebuilt from the state it was made against."""
+    game_state = {
+        'seq': delta['seq'],
+        'elapsed': delta['elapsed'],
+        'points_to_complete': delta.get('points_to_complete', base_state.get('points_to_complete')),
+    }
+    for key in ('terrains', 'foods', 'bonuses'):
+        game_state[key] = patch(base_state[key], *delta[key])
+
+    snakes = {}
+    for client_id, snake_data in delta['snakes'].items():
+        if 'append' not in snake_data:
+            snakes[client_id] = snake_data
+            continue
+        previous = base_state['snakes'].get(client_id)
+        if previous is None or 'body' not in previous:
+            raise ValueError(f"Delta continues unknown snake {client_id}")
+        appended, body = snake_data['append'], previous['body']
+        kept = len(body) - snake_data['trim']  # Old points still in the body, may go negative if new ones were trimmed too
+        snake = {key: value for key, value in snake_data.items() if key not in ('append', 'trim', 'count')}
+        snake['body'] = appended + body[:kept] if kept >= 0 else appended[:len(appended) + kept]
+        if 'count' in snake_data and len(snake['body']) != snake_data['count']:
+            raise ValueError(f"Snake {client_id} rebuilt with {len(snake['body'])} points instead of {snake_data['count']}")
+        snakes[client_id] = snake
+    game_state['snakes'] = snakes
+    return game_state
+
+
+def benchmark(level_number=2, snakes=4, ticks=2400, keyframe_interval=120):
+    # Bytes per tick for full snapshots, deltas with periodic keyframes and the body stream alone, with growing snakes
+    from .engine import World
+    from .snake import Snake
+    from . import protocol
+    world = World(seed=0)
+    world.load_level(level_number)
+    for owner in range(snakes):
+        world.add_snake(owner, Snake(start_pos=(config.SCREEN_WIDTH // 2, 2 * config.SNAKE_SIZE * (owner + 1))))
+    history = SnapshotHistory()
+    totals = {'full': 0, 'keyframes': 0, 'stream': 0}
+    for tick in range(1, ticks + 1):
+        for snake in world.snakes.values():
+            if tick % 60 == 0:
+                snake.change_direction(config.UP if tick % 120 else config.LEFT)
+            snake.grow(1 if tick % 4 == 0 else 0)
+            snake.lost = False
+        world.step()
+        history.record(tick, world, world.snakes)
+        full = len(protocol.encode_message({
+            'seq': tick,
+            'terrains': [terrain.get_terrain_data() for terrain in world.terrains if terrain.type in config.DYNAMIC_TERRAIN_TYPES],
+            'snakes': {owner: snake.get_snake_data(live_body=True) for owner, snake in world.snakes.items()},
+            'foods': [food.get_food_data() for food in world.foods],
+            'bonuses': [bonus.get_bonus_data() for bonus in world.bonuses],
+            'elapsed': world.elapsed,
+        }, protocol.BINARY_VERSION))
+        delta = full if tick == 1 else len(protocol.encode_message(history.delta(tick - 1, tick, world, world.snakes), protocol.BINARY_VERSION))
+        totals['full'] += full
+        totals['keyframes'] += full if tick % keyframe_interval == 1 else delta
+        totals['stream'] += delta
+    length = sum(len(snake.body) for snake in world.snakes.values()) // snakes
+    print(f"{snakes} snakes of {length} points after {ticks} ticks, bytes per tick: " +
+          ", ".join(f"{name} {total / ticks:.0f}" for name, total in totals.items()))
+
+
+if __name__ == "__main__":
+    benchmark()
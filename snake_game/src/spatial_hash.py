@@ -0,0 +1,86 @@
+from collections import deque
+from .geometry import square_rect, rects_collide
+from . import config
+
+
+class SpatialHash:
+    """Uniform grid of snake segments keyed by cell.
+
+    Each cell keeps, per owner, the segments whose centre falls in it in the
+    order they were added, so a head push and a tail pop are both O(1). A query
+    only visits the cells around the queried square, so its cost depends on the
+    local density instead of the total length of the snakes.
+    """
+
+    def __init__(self, cell_size=config.SPATIAL_HASH_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}         # (cell_x, cell_y) -> {owner: deque of (seq, x, y)}
+        self.block_sizes = {}   # owner -> segment size
+        self.head_seqs = {}     # owner -> sequence number of the newest segment
+        self.owner_cells = {}   # owner -> cells that may hold its segments
+
+    def cell_of(self, point):
+        return (int(point[0] // self.cell_size), int(point[1] // self.cell_size))
+
+    def add_body(self, owner, body, block_size):
+        self.block_sizes[owner] = block_size
+        self.owner_cells.setdefault(owner, set())
+        self.head_seqs[owner] = body.head_seq
+        for i in range(len(body) - 1, -1, -1):
+            self.add_segment(owner, body.head_seq - i, body[i])
+
+    def remove_owner(self, owner):
+        for cell in self.owner_cells.pop(owner, ()):
+            owners = self.cells.get(cell)
+            if owners is not None:
+                owners.pop(owner, None)
+                if not owners:
+                    del self.cells[cell]
+        self.block_sizes.pop(owner, None)
+        self.head_seqs.pop(owner, None)
+
+    def add_segment(self, owner, seq, point):
+        cell = self.cell_of(point)
+        self.cells.setdefault(cell, {}).setdefault(owner, deque()).append((seq, point[0], point[1]))
+        self.owner_cells[owner].add(cell)
+        if seq > self.head_seqs[owner]:
+            self.head_seqs[owner] = seq
+
+    def remove_segment(self, owner, seq, point):
+        # Tails leave in the order they were added, so the segment is the oldest one in its cell
+        cell = self.cell_of(point)
+        owners = self.cells[cell]
+        segments = owners[owner]
+        segments.popleft()
+        if not segments:
+            del owners[owner]
+            self.owner_cells[owner].discard(cell)
+            if not owners:
+                del self.cells[cell]
+
+    def query(self, position, size, exclude=None, min_age=0):
+        """Return the owners with a segment overlapping the square of `size` centred on `position`.
+
+        Segments of `exclude` are skipped, and so are the `min_age` newest segments of every snake.
+        """
+        obj_rect = square_rect(position, size)
+        reach = max(self.block_sizes.values(), default=0)
+        min_x, min_y = self.cell_of((obj_rect[0] - reach, obj_rect[1] - reach))
+        max_x, max_y = self.cell_of((obj_rect[0] + size + reach, obj_rect[1] + size + reach))
+
+        hits = set()
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                owners = self.cells.get((cell_x, cell_y))
+                if not owners:
+                    continue
+                for owner, segments in owners.items():
+                    if owner == exclude or owner in hits:
+                        continue
+                    block_size = self.block_sizes[owner]
+                    newest = self.head_seqs[owner] - min_age
+                    for seq, x, y in segments:
+                        if seq <= newest and rects_collide(obj_rect, square_rect((x, y), block_size)):
+                            hits.add(owner)
+                            break
+        return hits
@@ -1,5 +1,3 @@
-import pygame
-from .drawing import draw_terrain
 from . import config
 
 class Terrain:
@@ -9,6 +7,7 @@ class Terrain:
         self.size = config.TERRAIN_SIZES.get(self.type, config.DEFAULT_TERRAIN_SIZE)
 
     def draw(self, screen):
+        from .drawing import draw_terrain
         draw_terrain(screen, self.position, self.size, self.type)
 
     def get_terrain_data(self):
@@ -0,0 +1,63 @@
+from .geometry import square_rect, rects_collide
+from . import config
+
+
+class TerrainIndex:
+    """Lookups over a level's terrain, built once when the level is loaded.
+
+    Walls are bucketed in a coarse grid so a wall test only looks at nearby
+    tiles, other tiles are grouped by type, mushrooms are kept as a position
+    set and grails are referenced directly. Growing a mushroom or moving the
+    grail updates the index instead of rebuilding it.
+    """
+
+    def __init__(self, terrains, cell_size=config.TERRAIN_INDEX_CELL_SIZE):
+        self.cell_size = cell_size
+        self.wall_cells = {}  # (cell_x, cell_y) -> walls whose rect touches the cell
+        self.by_type = {}     # type -> tiles of that type, in level order
+        self.mushroom_positions = set()
+        self.grails = []
+        for terrain in terrains:
+            self.add(terrain)
+
+    def cells_of(self, rect):
+        first_x, first_y = rect[0] // self.cell_size, rect[1] // self.cell_size
+        last_x, last_y = (rect[0] + rect[2]) // self.cell_size, (rect[1] + rect[3]) // self.cell_size
+        return [(x, y) for x in range(first_x, last_x + 1) for y in range(first_y, last_y + 1)]
+
+    def add(self, terrain):
+        self.by_type.setdefault(terrain.type, []).append(terrain)
+        if terrain.type == "wall":
+            for cell in self.cells_of(square_rect(terrain.position, terrain.size)):
+                self.wall_cells.setdefault(cell, []).append(terrain)
+        elif terrain.type == "mushroom":
+            self.mushroom_positions.add(tuple(terrain.position))
+        elif terrain.type == "holy_grail":
+            self.grails.append(terrain)
+
+    def move(self, terrain, position):
+        if terrain.type == "wall":
+            for cell in self.cells_of(square_rect(terrain.position, terrain.size)):
+                self.wall_cells[cell].remove(terrain)
+        elif terrain.type == "mushroom":
+            self.mushroom_positions.discard(tuple(terrain.position))
+        terrain.position = position
+        if terrain.type == "wall":
+            for cell in self.cells_of(square_rect(terrain.position, terrain.size)):
+                self.wall_cells.setdefault(cell, []).append(terrain)
+        elif terrain.type == "mushroom":
+            self.mushroom_positions.add(tuple(position))
+
+    def of_type(self, terrain_type):
+        return self.by_type.get(terrain_type, [])
+
+    def has_mushroom(self, position):
+        return tuple(position) in self.mushroom_positions
+
+    def collides_with_wall(self, obj_position, obj_size):
+        obj_rect = square_rect(obj_position, obj_size)
+        for cell in self.cells_of(obj_rect):
+            for wall in self.wall_cells.get(cell, ()):
+                if rects_collide(obj_rect, square_rect(wall.position, wall.size)):
+                    return True
+        return False